@@ -0,0 +1,101 @@
+import pandas as pd
+
+# every dashboard count is a roll-up of this table: one row per distinct
+# combination of these columns, which are all functions of (user, day, hour, sentiment)
+base_columns = ['user', 'only_date', 'year', 'month_num', 'month', 'day_name', 'hour', 'period',
+                'sentiment_category']
+
+
+# totals of a base column (message counts by default) per (user, *keys) with an
+# extra 'Overall' block for the whole chat
+def _per_user(base, keys, column='message'):
+    per_user = base.groupby(['user'] + keys, observed=True)[column].sum()
+    overall = base.groupby(keys, observed=True)[column].sum()
+    overall = pd.concat({'Overall': overall}, names=['user'])
+    return pd.concat([overall, per_user]).sort_index()
+
+
+# all per-user and Overall aggregates the dashboard shows, computed in one grouped
+# pass over the messages so that rendering a panel for any user is a lookup
+class Aggregates:
+
+    def __init__(self, df=None, base=None):
+        if base is None:
+            # message count and summed sentiment score per combination
+            base = (df.groupby(base_columns, observed=True, dropna=False)['sentiment']
+                    .agg(message='size', sentiment='sum').reset_index())
+        self.base = base
+
+        self.users = self.base.groupby('user')['message'].sum().sort_values(ascending=False)
+        self.monthly = _per_user(self.base, ['year', 'month_num', 'month'])
+        self.daily = _per_user(self.base, ['only_date'])
+        self.daily_sentiment = _per_user(self.base, ['only_date'], 'sentiment')
+        self.weekday = _per_user(self.base, ['day_name'])
+        self.months = _per_user(self.base, ['month'])
+        self.heatmap = _per_user(self.base, ['day_name', 'period'])
+        self.sentiment = _per_user(self.base, ['sentiment_category'])
+
+    # aggregates after appending new messages: only the new rows are grouped and the
+    # roll-ups are rebuilt from the combined count table
+    def extend(self, tail_df):
+        head, tail = self.base.copy(), Aggregates(tail_df).base
+        # categoricals are concatenated as object columns unless their categories match,
+        # so both parts get the sorted union, as a full parse would build
+        for column in base_columns:
+            if isinstance(head[column].dtype, pd.CategoricalDtype):
+                categories = head[column].cat.categories.union(tail[column].cat.categories)
+                head[column] = head[column].cat.set_categories(categories)
+                tail[column] = tail[column].cat.set_categories(categories)
+        base = pd.concat([head, tail], ignore_index=True)
+        base = base.groupby(base_columns, observed=True, dropna=False)[['message', 'sentiment']].sum().reset_index()
+        return Aggregates(base=base)
+
+    @property
+    def nbytes(self):
+        rollups = [self.users, self.monthly, self.daily, self.daily_sentiment, self.weekday, self.months,
+                   self.heatmap, self.sentiment]
+        return int(self.base.memory_usage(deep=True).sum()) + sum(int(series.memory_usage(deep=True))
+                                                                 for series in rollups)
+
+    @staticmethod
+    def _lookup(series, selected_user):
+        try:
+            return series.loc[selected_user]
+        except KeyError:
+            return series.iloc[:0].droplevel('user')
+
+    def monthly_timeline(self, selected_user):
+        timeline = self._lookup(self.monthly, selected_user).reset_index()
+        timeline['time'] = timeline['month'].astype(str) + "-" + timeline['year'].astype(str)
+        return timeline
+
+    def daily_timeline(self, selected_user):
+        return self._lookup(self.daily, selected_user).reset_index()
+
+    def week_activity_map(self, selected_user):
+        return self._lookup(self.weekday, selected_user).sort_values(ascending=False).rename('count')
+
+    def month_activity_map(self, selected_user):
+        return self._lookup(self.months, selected_user).sort_values(ascending=False).rename('count')
+
+    def activity_heatmap(self, selected_user):
+        counts = self._lookup(self.heatmap, selected_user)
+        if counts.empty:
+            return pd.DataFrame()
+        return counts.unstack('period').fillna(0)
+
+    def sentiment_counts(self, selected_user):
+        counts = self._lookup(self.sentiment, selected_user).sort_values(ascending=False).reset_index()
+        counts.columns = ['Sentiment', 'Count']
+        return counts
+
+    # mean sentiment score per day
+    def sentiment_timeline(self, selected_user):
+        totals = self._lookup(self.daily_sentiment, selected_user)
+        return (totals / self._lookup(self.daily, selected_user)).rename('sentiment').reset_index()
+
+    def most_busy_users(self):
+        x = self.users.head().rename('count')
+        percent = round((self.users / self.users.sum()) * 100, 2).reset_index()
+        percent.columns = ['name', 'percent']
+        return x, percent
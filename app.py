@@ -1,12 +1,13 @@
 import streamlit as st
-import preprocessor,helper
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
+import helper
+import cache
+import charts
+import export
+import jobs
 import pandas as pd
 import os
 import hashlib
-
+import time
 
 
 USER_DATA_FILE = "users.csv"
@@ -127,25 +128,101 @@ if options == "ChatFlow Analyzer":
         uploaded_file = st.sidebar.file_uploader("Choose a file")
 
         if uploaded_file is not None:
-            with st.spinner('Processing the uploaded file...'):
-                bytes_data = uploaded_file.getvalue()
-                data = bytes_data.decode("utf-8")
-                df = preprocessor.preprocess(data)
+            # the upload is read as a stream, a .txt export or a zip with the chat inside;
+            # it is hashed once and the page polls the job with the keys on every rerun
+            chat_keys = st.session_state.setdefault('chat_keys', {})
+            try:
+                new_upload = uploaded_file.file_id not in chat_keys
+                if new_upload:
+                    chat_keys[uploaded_file.file_id] = jobs.job_queue.upload_keys(uploaded_file)
+                # parsed on the job queue, sessions uploading the same export share one job;
+                # a failed parse is only retried when the file is uploaded again
+                job = jobs.job_queue.submit(uploaded_file, chat_keys[uploaded_file.file_id], retry=new_upload)
+            except (jobs.JobRejected, ValueError) as error:
+                st.error(str(error))
+                st.stop()
+            if not job.finished:
+                st.progress(job.fraction, text=f"Processing the uploaded file: {job.stage}...")
+                time.sleep(0.5)
+                st.rerun()
+            if job.error is not None:
+                st.error(f"The file could not be processed: {job.error}")
+                st.stop()
+            chat_hash, chat = job.key, job.chat
 
             st.success('File has been uploaded successfully 🎉')
+            sentiment_stats = chat.attrs.get('sentiment_stats')
+            if sentiment_stats:
+                st.sidebar.caption(
+                    f"Sentiment: {sentiment_stats['scored']} of {sentiment_stats['messages']} messages scored, "
+                    f"cache hit rate {sentiment_stats['cache_hit_rate']:.0%}"
+                )
             
 
             # fetch unique users
-            user_list = df['user'].unique().tolist()
-            user_list.remove('group_notification')
-            user_list.sort()
+            user_list = chat.users
             user_list.insert(0,"Overall")
 
             selected_user = st.sidebar.selectbox("Select user for analysis",user_list)
 
+            # figures are built once per chat, user and panel and reused on every rerun
+            def figure(panel):
+                return charts.figure_cache.get(chat_hash, selected_user, panel, chat)
+
+            # kept outside the analysis button so typing a query or turning a page keeps it open
+            with st.expander("🔎 Search Messages"):
+                query = st.text_input('Words to find, "quoted phrases", OR between alternatives')
+                # the days are an unordered categorical, compared as plain dates
+                chat_days = helper.daily_timeline('Overall', chat)['only_date'].astype(object)
+                date_range = st.date_input("Sent between", value=(chat_days.min(), chat_days.max())) \
+                    if not chat_days.empty else ()
+                if query:
+                    # loads or stores the index beside the cached chat
+                    cache.chat_cache.search_index(chat_hash, chat)
+                    start, end = date_range if len(date_range) == 2 else (None, None)
+                    hits = helper.search_messages(selected_user, chat, query, start, end)
+                    st.caption(f"{len(hits)} matching messages" +
+                               ("" if selected_user == 'Overall' else f" from {selected_user}"))
+                    if len(hits):
+                        page = st.number_input("Page", min_value=1, max_value=helper.search_page_count(hits), value=1)
+                        st.dataframe(helper.search_results(chat, hits, page))
+
+            # outside the analysis button too, picking a format or clicking download reruns the page
+            with st.expander("📥 Download Reports"):
+                col1, col2 = st.columns(2)
+
+                with col1:
+                    export_format = st.selectbox("Report format", export.DATA_FORMATS,
+                                                 format_func=lambda fmt: export.FORMAT_LABELS[fmt])
+                    if st.button("Download Report"):
+                        # written once per chat, user and format, later clicks reuse the file
+                        with st.spinner("Preparing report..."):
+                            report_path = export.export_chat(chat, chat_hash, selected_user, export_format)
+                        extension, mime = export.FORMATS[export_format]
+                        with open(report_path, 'rb') as report:
+                            st.download_button(
+                                label=f"Download {export.FORMAT_LABELS[export_format]}",
+                                data=report,
+                                file_name="chat_analysis_report" + extension,
+                                mime=mime
+                            )
+
+                with col2:
+                    if st.button("Download PDF Report", key="download_pdf_button"):
+                        with st.spinner("Preparing report..."):
+                            pdf_path = export.export_chat(chat, chat_hash, selected_user, 'pdf')
+                        with open(pdf_path, 'rb') as report:
+                            st.download_button(
+                                label="Download PDF",
+                                data=report,
+                                file_name="chat_analysis_report.pdf",
+                                mime="application/pdf",
+                                key="pdf_download_button"
+                            )
+
             if st.sidebar.button("Show Analysis"):
                 # Stats Area
-                num_messages, words, num_media_messages, num_links = helper.fetch_stats(selected_user,df)
+                num_messages, words, num_media_messages, num_links = helper.fetch_stats(selected_user,chat)
 
                 # Add a colored divider line
                 st.markdown("<hr style='border: 1px solid #4CAF50;'>", unsafe_allow_html=True)  # Green line
@@ -158,25 +235,24 @@ if options == "ChatFlow Analyzer":
                 col3.metric("Media Shared", num_media_messages)
                 col4.metric("Links Shared", num_links)
 
+                domain_df = helper.most_shared_domains(selected_user, chat)
+                if not domain_df.empty:
+                    st.subheader("🔗 Top Shared Domains")
+                    st.dataframe(domain_df.head(10))
+
                 # Add a colored divider line
                 st.markdown("<hr style='border:1px solid green'>", unsafe_allow_html=True)
                 
                 # Monthly Timeline
                 st.subheader("📅 Monthly Timeline")
-                timeline = helper.monthly_timeline(selected_user, df)
-                fig = px.line(timeline, x='time', y='message', title="Messages Over Time", markers=True)
-                fig.update_layout(xaxis_title="Time", yaxis_title="Messages", template="plotly_dark")
-                st.plotly_chart(fig)
+                st.plotly_chart(figure('monthly_timeline'))
 
                 # Add a colored divider line
                 st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
 
                 # daily timeline
                 st.subheader("📆 Daily Timeline")
-                daily_timeline = helper.daily_timeline(selected_user, df)
-                fig = px.line(daily_timeline, x='only_date', y='message', title="Messages Per Day", markers=True)
-                fig.update_layout(xaxis_title="Date", yaxis_title="Messages", template="plotly_white")
-                st.plotly_chart(fig)
+                st.plotly_chart(figure('daily_timeline'))
 
                 # Add a colored divider line
                 st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
@@ -187,31 +263,21 @@ if options == "ChatFlow Analyzer":
 
                 with col1:
                     st.header("Most busy day")
-                    busy_day = helper.week_activity_map(selected_user,df)
-                    fig,ax = plt.subplots()
-                    ax.bar(busy_day.index,busy_day.values,color='purple')
-                    plt.xticks(rotation='vertical')
-                    st.pyplot(fig)
+                    st.image(figure('busy_day'))
 
                 with col2:
                     st.header("Most busy month")
-                    busy_month = helper.month_activity_map(selected_user, df)
-                    fig, ax = plt.subplots()
-                    ax.bar(busy_month.index, busy_month.values,color='orange')
-                    plt.xticks(rotation='vertical')
-                    st.pyplot(fig)
+                    st.image(figure('busy_month'))
                 
                 # Add a colored divider line
                 st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
 
                 # Weekly Activity Heatmap
                 st.subheader("📅 Weekly Activity Heatmap")
-                user_heatmap = helper.activity_heatmap(selected_user, df)
+                user_heatmap = figure('activity_heatmap')
 
-                if not user_heatmap.empty:
-                    fig, ax = plt.subplots()
-                    ax = sns.heatmap(user_heatmap)
-                    st.pyplot(fig)
+                if user_heatmap is not None:
+                    st.image(user_heatmap)
                 else:
                     st.write("No activity data available for the selected user.")
 
@@ -221,7 +287,7 @@ if options == "ChatFlow Analyzer":
                 # finding the busiest users in the group(Group level)
                 if selected_user == 'Overall':
                     st.subheader("👥 Most Active Users")
-                    x, new_df = helper.most_busy_users(df)
+                    x, new_df = helper.most_busy_users(chat)
                     col1, col2 = st.columns(2)
                     with col1:
                         st.bar_chart(x)
@@ -231,12 +297,44 @@ if options == "ChatFlow Analyzer":
                 # Add a colored divider line
                 st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
 
+                # Reply times
+                st.subheader("⏱️ Reply Times")
+                reply_df = helper.reply_times(selected_user, chat)
+                if reply_df.empty:
+                    st.write("No replies found for the selected user.")
+                else:
+                    if selected_user == 'Overall':
+                        st.caption("Minutes each member takes to answer someone else")
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.dataframe(reply_df)
+                        with col2:
+                            st.caption("Median minutes to reply (rows reply to columns)")
+                            st.dataframe(helper.reply_matrix(chat))
+                    else:
+                        st.caption(f"Minutes {selected_user} takes to answer each member")
+                        st.dataframe(reply_df)
+
+                # Conversations
+                st.subheader("💬 Conversations")
+                conversations = helper.conversation_summary(selected_user, chat)
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Conversations", conversations['sessions'])
+                col2.metric("Median Length (min)", f"{conversations['median_minutes']:.0f}")
+                col3.metric("Messages per Conversation", f"{conversations['mean_messages']:.1f}")
+                if selected_user == 'Overall':
+                    st.bar_chart(helper.conversation_starters(chat).set_index('user'))
+                else:
+                    col1, col2 = st.columns(2)
+                    col1.metric("Conversations Started", conversations['started'])
+                    col2.metric("Conversations Ended", conversations['ended'])
+
+                # Add a colored divider line
+                st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
+
                 # WordCloud
                 st.subheader("🔤 Most Common Words")
-                df_wc = helper.create_wordcloud(selected_user,df)
-                fig,ax = plt.subplots()
-                ax.imshow(df_wc)
-                st.pyplot(fig)
+                st.image(figure('wordcloud'))
 
 
                 # Add a colored divider line
@@ -245,9 +343,7 @@ if options == "ChatFlow Analyzer":
 
                 # Most Common Words
                 st.subheader("🔤 Most Common Words")
-                most_common_df = helper.most_common_words(selected_user, df)
-                fig = px.bar(most_common_df, x=0, y=1, title="Most Common Words", labels={"0": "Words", "1": "Frequency"})
-                st.plotly_chart(fig)
+                st.plotly_chart(figure('most_common_words'))
 
                 # Add a colored divider line
                 st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
@@ -255,21 +351,13 @@ if options == "ChatFlow Analyzer":
 
                 # Emoji Analysis
                 st.subheader("😊 Emoji Analysis")
-                emoji_df = helper.emoji_helper(selected_user, df)
+                emoji_df = helper.emoji_helper(selected_user, chat)
                 if not emoji_df.empty:
                     col1, col2 = st.columns(2)
                     with col1:
                         st.dataframe(emoji_df.head())
                     with col2:
-                        # Use column names for 'names' and 'values'
-                        fig = px.pie(
-                            emoji_df.head(),
-                            values="count",
-                            names="emoji",
-                            title="Top Emojis",
-                            labels={"emoji": "Emoji", "count": "Count"}
-                        )
-                        st.plotly_chart(fig)
+                        st.plotly_chart(figure('emoji_pie'))
                 else:
                     st.warning("No emoji data available for the selected user.")
                 
@@ -281,9 +369,7 @@ if options == "ChatFlow Analyzer":
                 # Sentiment Analysis Section
                 st.subheader("🧠 Sentiment Analysis")
 
-                sentiment_df = df[df['user'] == selected_user] if selected_user != "Overall" else df
-                sentiment_counts = sentiment_df['sentiment_category'].value_counts().reset_index()
-                sentiment_counts.columns = ['Sentiment', 'Count']
+                sentiment_counts = helper.fetch_sentiment_stats(chat, selected_user)
 
                 col1, col2 = st.columns(2)
 
@@ -292,68 +378,50 @@ if options == "ChatFlow Analyzer":
                     st.dataframe(sentiment_counts)
 
                 with col2:
-                    fig = px.pie(sentiment_counts, values='Count', names='Sentiment', title="Sentiment Distribution",
-                                color='Sentiment',
-                                color_discrete_map={'Positive': '#4CAF50', 'Neutral': '#FFC107', 'Negative': '#F44336'})
-                    st.plotly_chart(fig)
+                    st.plotly_chart(figure('sentiment_pie'))
 
                 # Add a colored divider line
                 st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
 
 
-                # Ensure 'sentiment' column is numeric and handle any conversion issues
-                if 'sentiment' not in sentiment_df.columns:
-                    st.warning("Sentiment column is missing. Please perform sentiment analysis.")
+                # scores are computed while parsing, so every message already has one
+                if sentiment_counts.empty:
+                    st.warning("No sentiment data available.")
                 else:
+                    # Sentiment Over Time Plot
+                    st.subheader("📈 Sentiment Over Time")
+                    sentiment_timeline = figure('sentiment_timeline')
 
-                    # Convert sentiment to numeric, coercing errors to NaN
-                    sentiment_df['sentiment'] = pd.to_numeric(sentiment_df['sentiment'], errors='coerce')
-                    
-                    # Drop rows with NaN values in 'sentiment' column
-                    sentiment_df = sentiment_df.dropna(subset=['sentiment'])
-
-                    # Check if sentiment column contains any valid data
-                    if sentiment_df.empty:
-                        st.warning("No sentiment data available.")
+                    # If the sentiment_timeline is empty, issue a warning
+                    if sentiment_timeline is None:
+                        st.warning("No sentiment data available to display the graph.")
                     else:
-                        # Sentiment Over Time Plot
-                        st.subheader("📈 Sentiment Over Time")
-                        sentiment_df['only_date'] = pd.to_datetime(sentiment_df['only_date'], errors='coerce')  # Ensure the date column is in proper format
-                        sentiment_timeline = sentiment_df.groupby('only_date')['sentiment'].mean().reset_index()
-
-                        # If the sentiment_timeline is empty, issue a warning
-                        if sentiment_timeline.empty:
-                            st.warning("No sentiment data available to display the graph.")
-                        else:
-                            fig = px.line(sentiment_timeline, x='only_date', y='sentiment', title="Average Sentiment Over Time")
-                            fig.update_layout(xaxis_title="Date", yaxis_title="Sentiment", template="plotly_dark")
-                            st.plotly_chart(fig)
+                        st.plotly_chart(sentiment_timeline)
 
 
-                        # Add a colored divider line
-                        st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
+                    # Add a colored divider line
+                    st.markdown("<hr style='border:1px solid blue'>", unsafe_allow_html=True)
 
-                        # Top Positive & Negative Messages
-                        st.subheader("🔝 Top Positive & Negative Messages")
-                        col1, col2 = st.columns(2)
+                    # Top Positive & Negative Messages
+                    st.subheader("🔝 Top Positive & Negative Messages")
+                    positive_messages, negative_messages = helper.top_sentiment_messages(selected_user, chat)
+                    col1, col2 = st.columns(2)
 
-                        with col1:
-                            st.write("#### Positive Messages 😊")
-                            positive_messages = sentiment_df[sentiment_df['sentiment'] > 0.5].sort_values(by='sentiment', ascending=False).head(5)
-                            if positive_messages.empty:
-                                st.warning("No positive messages found.")
-                            else:
-                                for _, message in positive_messages.iterrows():
-                                    st.write(f"📩 {message['message']} (Sentiment: {message['sentiment']:.2f})")
+                    with col1:
+                        st.write("#### Positive Messages 😊")
+                        if positive_messages.empty:
+                            st.warning("No positive messages found.")
+                        else:
+                            for _, message in positive_messages.iterrows():
+                                st.write(f"📩 {message['message']} (Sentiment: {message['sentiment']:.2f})")
 
-                        with col2:
-                            st.write("#### Negative Messages 😔")
-                            negative_messages = sentiment_df[sentiment_df['sentiment'] < -0.5].sort_values(by='sentiment').head(5)
-                            if negative_messages.empty:
-                                st.warning("No negative messages found.")
-                            else:
-                                for _, message in negative_messages.iterrows():
-                                    st.write(f"📩 {message['message']} (Sentiment: {message['sentiment']:.2f})")
+                    with col2:
+                        st.write("#### Negative Messages 😔")
+                        if negative_messages.empty:
+                            st.warning("No negative messages found.")
+                        else:
+                            for _, message in negative_messages.iterrows():
+                                st.write(f"📩 {message['message']} (Sentiment: {message['sentiment']:.2f})")
 
 
 
@@ -361,35 +429,6 @@ if options == "ChatFlow Analyzer":
                 # Add a colored divider line
                 st.markdown("<hr style='border: 1px solid blue;'>", unsafe_allow_html=True)  # Green line
 
-                
-                col1, col2 = st.columns(2)
-
-                with col1:
-                
-                    if st.button("Download Excel Report"):
-                        excel_buffer = helper.generate_excel(df)
-                        st.download_button(
-                            label="Download Excel",
-                            data=excel_buffer,
-                            file_name="chat_analysis_report.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
-                
-                with col2:
-
-                    if st.button("Download PDF Report", key="download_pdf_button"):
-                        pdf_buffer = helper.generate_pdf(df)
-                        st.download_button(
-                            label="Download PDF",
-                            data=pdf_buffer,
-                            file_name="chat_analysis_report.pdf",
-                            mime="application/pdf",
-                            key="pdf_download_button"
-                        )
-                        
-
-                st.markdown("<hr style='border: 1px solid blue;'>", unsafe_allow_html=True)  # Green line
-
 
                 # Social Media Buttons
                 st.subheader("🌐 Connect with Me")
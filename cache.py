@@ -0,0 +1,219 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import ingest
+import preprocessor
+import store
+from chat import Chat
+
+# parsed chats kept in memory across Streamlit reruns, least recently used evicted first
+MAX_MEMORY_BYTES = int(os.environ.get('CHAT_CACHE_MB', 1024)) * 1024 * 1024
+# set to a directory to also keep parsed chats in the chat store across server restarts
+CACHE_DIR = os.environ.get('CHAT_CACHE_DIR')
+# re-exports of the same chat are recognised by their first lines
+FINGERPRINT_LINES = 50
+
+
+def _key_digest():
+    digest = hashlib.sha256()
+    digest.update(str(preprocessor.PARSER_VERSION).encode())
+    return digest
+
+
+# key, fingerprint and byte size of an upload's chat text in one streamed pass. The
+# same export parsed by the same parser version always gets the same key, and the
+# fingerprint hashes the first lines, shared by every later export of the same chat,
+# so a .txt and a zip holding the same export share both
+def source_keys(source):
+    digest = _key_digest()
+    head = hashlib.sha256()
+    lines = size = 0
+    with ingest.open_export(source) as binary:
+        for chunk in ingest.read_chunks(binary):
+            digest.update(chunk)
+            size += len(chunk)
+            end = 0
+            while lines < FINGERPRINT_LINES:
+                end = chunk.find(b'\n', end) + 1
+                if end == 0:
+                    end = len(chunk)
+                    break
+                lines += 1
+            if end:
+                head.update(memoryview(chunk)[:end])
+    return digest.hexdigest(), head.hexdigest(), size
+
+
+class ChatCache:
+
+    def __init__(self, max_bytes=MAX_MEMORY_BYTES, directory=CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.chats = OrderedDict()
+        # fingerprint -> key of the longest export of that chat seen so far
+        self.fingerprints = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _prefix(self, key):
+        return os.path.join(self.directory, key)
+
+    def _fingerprint_path(self, fingerprint):
+        return os.path.join(self.directory, fingerprint + '.latest')
+
+    def latest(self, fingerprint):
+        if fingerprint in self.fingerprints:
+            return self.fingerprints[fingerprint]
+        if self.directory and os.path.exists(self._fingerprint_path(fingerprint)):
+            with open(self._fingerprint_path(fingerprint), 'r') as f:
+                return f.read().strip()
+        return None
+
+    def _set_latest(self, fingerprint, key):
+        self.fingerprints[fingerprint] = key
+        if self.directory:
+            with open(self._fingerprint_path(fingerprint), 'w') as f:
+                f.write(key)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.chats.get(key)
+        if entry is not None:
+            # measured again on every hit: columns converted from a stored chat and
+            # indexes built since it was last counted take memory too
+            self._remember(key, entry[0])
+            return entry[0]
+
+        if self.stored(key):
+            try:
+                chat = store.open_chat(self._prefix(key))
+            except Exception:
+                # unreadable or half-written file, parse again
+                return None
+            self._remember(key, chat)
+            return chat
+        return None
+
+    def stored(self, key):
+        return bool(self.directory) and store.exists(self._prefix(key))
+
+    def put(self, key, chat):
+        self._remember(key, chat)
+        if self.directory:
+            try:
+                store.write_chat(self._prefix(key), chat)
+            except Exception:
+                # a chat that cannot be stored is still served from memory
+                pass
+
+    def _remember(self, key, chat):
+        nbytes = chat.nbytes
+        with self.lock:
+            if key in self.chats:
+                self.size -= self.chats.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self.chats[key] = (chat, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.chats.popitem(last=False)
+                self.size -= evicted
+
+    # a longer re-export of a chat already parsed: the stored chat must be a byte
+    # prefix of the upload ending on a line break, then only the tail is parsed.
+    # previous is the (key, chat) of that earlier export when another cache holds it
+    def _extend(self, source, fingerprint, size, progress=None, previous=None):
+        old_key, old = previous or (self.latest(fingerprint), None)
+        if old is None and old_key:
+            old = self.get(old_key)
+        if old is None:
+            return None
+
+        old_size = old.attrs.get('source_size', 0)
+        if not 0 < old_size < size:
+            return None
+        with ingest.open_export(source) as binary:
+            digest = _key_digest()
+            remaining = old_size
+            last = b''
+            while remaining:
+                chunk = binary.read(min(ingest.CHUNK_BYTES, remaining))
+                if not chunk:
+                    return None
+                digest.update(chunk)
+                remaining -= len(chunk)
+                last = chunk[-1:]
+            if last != b'\n' or digest.hexdigest() != old_key:
+                return None
+            appended = preprocessor.append_messages(old.df, ingest.chat_lines(binary), progress=progress)
+        if appended is None:
+            return None
+        df, tail_df = appended
+        return old.extend(df, tail_df)
+
+    # the chat's search index, read from the store when it was built before and
+    # stored after it is first built
+    def search_index(self, key, chat):
+        if chat._search_index is None and self.directory:
+            prefix = self._prefix(key)
+            if os.path.exists(store.search_path(prefix)):
+                try:
+                    chat._search_index = store.open_search_index(prefix)
+                except Exception:
+                    pass
+            if chat._search_index is None:
+                chat.search_index
+                try:
+                    store.write_search_index(prefix, chat.search_index)
+                except Exception:
+                    pass
+        return chat.search_index
+
+    # parsed chat for an uploaded export (bytes or a binary file, a .txt or a zip),
+    # running preprocess only on a miss; the upload is streamed to the parser rather
+    # than decoded whole. progress is called with the name of each stage as it starts
+    def load(self, source, workers=None, progress=None, keys=None, previous=None):
+        key, fingerprint, size = keys or source_keys(source)
+        chat = self.get(key)
+        if chat is None:
+            chat = self._extend(source, fingerprint, size, progress, previous)
+            if chat is None:
+                with ingest.open_export(source) as binary:
+                    chat = Chat(preprocessor.preprocess(ingest.chat_lines(binary), workers=workers,
+                                                        progress=progress, size=size))
+            chat.attrs['source_size'] = size
+            # build the aggregates now so the first render is only lookups
+            if progress:
+                progress('aggregates')
+            chat.aggregates
+            chat.token_index
+            if progress:
+                progress('store')
+            self.put(key, chat)
+            self._set_latest(fingerprint, key)
+        return key, chat
+
+    # a chat loaded by another process: kept in memory, or opened from the store when
+    # that process already wrote it there, and made the latest export of its chat
+    def adopt(self, key, fingerprint, chat=None):
+        if chat is None:
+            chat = self.get(key)
+        else:
+            self._remember(key, chat)
+        if chat is not None:
+            self._set_latest(fingerprint, key)
+        return chat
+
+    # (key, chat) of the latest export of the chat with this fingerprint held in memory,
+    # for a cache in another process that cannot read it from the store
+    def previous(self, fingerprint):
+        old_key = self.latest(fingerprint)
+        if old_key is None or self.directory:
+            return None
+        old = self.get(old_key)
+        return None if old is None else (old_key, old)
+
+chat_cache = ChatCache()
@@ -0,0 +1,177 @@
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import helper
+import lazy
+
+px = lazy.module('plotly.express')
+sns = lazy.module('seaborn')
+mpl_figure = lazy.module('matplotlib.figure')
+
+# line charts with more points than this are downsampled before they are sent to the browser
+POINT_BUDGET = int(os.environ.get('CHART_POINTS', 1500))
+# figures kept across reruns, least recently used dropped first
+MAX_FIGURES = int(os.environ.get('CHART_CACHE_SIZE', 256))
+
+
+# indices of the points Largest-Triangle-Three-Buckets keeps: the first and last point
+# plus, per bucket, the point spanning the largest triangle with its neighbours
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        following = slice(stop, edges[bucket + 2] if bucket + 2 < len(edges) else n)
+        mean_x, mean_y = x[following].mean(), y[following].mean()
+        area = np.abs((x[previous] - mean_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (mean_y - y[previous]))
+        previous = start + int(area.argmax())
+        keep[bucket + 1] = previous
+    return keep
+
+
+# the rows of a line chart's frame that fit in the point budget, x may hold dates
+def downsample(df, x, y, budget=None):
+    budget = budget or POINT_BUDGET
+    if len(df) <= budget:
+        return df
+    try:
+        x_values = pd.to_datetime(df[x]).to_numpy(dtype='datetime64[ns]').astype('int64')
+    except (TypeError, ValueError):
+        x_values = np.arange(len(df))
+    return df.iloc[lttb(x_values, df[y].to_numpy(), budget)]
+
+
+def _png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+
+# matplotlib figures are built without pyplot, so nothing is left open between reruns
+def _bar_png(series, color):
+    fig = mpl_figure.Figure()
+    ax = fig.subplots()
+    ax.bar(series.index.astype(str), series.values, color=color)
+    ax.tick_params(axis='x', labelrotation=90)
+    return _png(fig)
+
+
+def monthly_timeline(selected_user, chat):
+    timeline = helper.monthly_timeline(selected_user, chat)
+    fig = px.line(downsample(timeline, 'time', 'message'), x='time', y='message',
+                  title="Messages Over Time", markers=True)
+    fig.update_layout(xaxis_title="Time", yaxis_title="Messages", template="plotly_dark")
+    return fig
+
+
+def daily_timeline(selected_user, chat):
+    timeline = helper.daily_timeline(selected_user, chat)
+    fig = px.line(downsample(timeline, 'only_date', 'message'), x='only_date', y='message',
+                  title="Messages Per Day", markers=True)
+    fig.update_layout(xaxis_title="Date", yaxis_title="Messages", template="plotly_white")
+    return fig
+
+
+def busy_day(selected_user, chat):
+    return _bar_png(helper.week_activity_map(selected_user, chat), 'purple')
+
+
+def busy_month(selected_user, chat):
+    return _bar_png(helper.month_activity_map(selected_user, chat), 'orange')
+
+
+def activity_heatmap(selected_user, chat):
+    user_heatmap = helper.activity_heatmap(selected_user, chat)
+    if user_heatmap.empty:
+        return None
+    fig = mpl_figure.Figure()
+    sns.heatmap(user_heatmap, ax=fig.subplots())
+    return _png(fig)
+
+
+def wordcloud(selected_user, chat):
+    buffer = BytesIO()
+    helper.create_wordcloud(selected_user, chat).to_image().save(buffer, format='png')
+    return buffer.getvalue()
+
+
+def most_common_words(selected_user, chat):
+    most_common_df = helper.most_common_words(selected_user, chat)
+    return px.bar(most_common_df, x=0, y=1, title="Most Common Words", labels={"0": "Words", "1": "Frequency"})
+
+
+def emoji_pie(selected_user, chat):
+    emoji_df = helper.emoji_helper(selected_user, chat)
+    if emoji_df.empty:
+        return None
+    return px.pie(emoji_df.head(), values="count", names="emoji", title="Top Emojis",
+                  labels={"emoji": "Emoji", "count": "Count"})
+
+
+def sentiment_pie(selected_user, chat):
+    sentiment_counts = helper.fetch_sentiment_stats(chat, selected_user)
+    return px.pie(sentiment_counts, values='Count', names='Sentiment', title="Sentiment Distribution",
+                  color='Sentiment',
+                  color_discrete_map={'Positive': '#4CAF50', 'Neutral': '#FFC107', 'Negative': '#F44336'})
+
+
+def sentiment_timeline(selected_user, chat):
+    timeline = helper.sentiment_timeline(selected_user, chat)
+    if timeline.empty:
+        return None
+    fig = px.line(downsample(timeline, 'only_date', 'sentiment'), x='only_date', y='sentiment',
+                  title="Average Sentiment Over Time")
+    fig.update_layout(xaxis_title="Date", yaxis_title="Sentiment", template="plotly_dark")
+    return fig
+
+
+# plotly panels return a figure, matplotlib and word cloud panels PNG bytes, and
+# None when there is nothing to draw
+panels = {
+    'monthly_timeline': monthly_timeline,
+    'daily_timeline': daily_timeline,
+    'busy_day': busy_day,
+    'busy_month': busy_month,
+    'activity_heatmap': activity_heatmap,
+    'wordcloud': wordcloud,
+    'most_common_words': most_common_words,
+    'emoji_pie': emoji_pie,
+    'sentiment_pie': sentiment_pie,
+    'sentiment_timeline': sentiment_timeline,
+}
+
+
+class FigureCache:
+
+    def __init__(self, max_figures=MAX_FIGURES):
+        self.max_figures = max_figures
+        self.figures = OrderedDict()
+        self.lock = threading.Lock()
+
+    # a panel's figure for a chat and user, built on the first request only
+    def get(self, chat_hash, selected_user, panel, chat):
+        key = (chat_hash, selected_user, panel)
+        with self.lock:
+            if key in self.figures:
+                self.figures.move_to_end(key)
+                return self.figures[key]
+
+        figure = panels[panel](selected_user, chat)
+        with self.lock:
+            self.figures[key] = figure
+            while len(self.figures) > self.max_figures:
+                self.figures.popitem(last=False)
+        return figure
+
+figure_cache = FigureCache()
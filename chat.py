@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from aggregates import Aggregates
+from interactions import Interactions
+from search import SearchIndex
+from tokenizer import TokenIndex
+
+
+# a parsed chat with its rows indexed by user, built once after preprocess so the
+# helpers get a user's messages without scanning the whole frame every time.
+# A chat opened from the store is backed by a memory-mapped Arrow table and only
+# converts the columns that are asked for.
+class Chat:
+
+    def __init__(self, df=None, table=None, attrs=None):
+        self._df = df
+        self.table = table
+        self._attrs = attrs
+        self._columns = {}
+        self._rows = None
+        self._aggregates = None
+        self._token_index = None
+        self._interactions = None
+        self._search_index = None
+
+    # the whole parsed frame
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = self.table.to_pandas()
+            self._df.attrs = dict(self._attrs or {})
+        return self._df
+
+    @property
+    def attrs(self):
+        if self._df is not None:
+            return self._df.attrs
+        return self._attrs
+
+    # memory the chat holds: its frame or converted columns, the mapped file only once
+    # it is converted, and every index built over it so far
+    @property
+    def nbytes(self):
+        if self._df is not None:
+            nbytes = int(self._df.memory_usage(deep=True).sum())
+        else:
+            nbytes = sum(int(column.memory_usage(deep=True)) for column in self._columns.values())
+        for built in [self._aggregates, self._token_index, self._interactions, self._search_index]:
+            if built is not None:
+                nbytes += built.nbytes
+        return nbytes
+
+    # only the given columns, without converting the rest of a stored chat
+    def frame(self, columns=None):
+        if columns is None or self._df is not None:
+            return self.df if columns is None else self.df[columns]
+        for name in columns:
+            if name not in self._columns:
+                self._columns[name] = self.table.column(name).to_pandas()
+        return pd.DataFrame({name: self._columns[name] for name in columns})
+
+    # user -> positions of that user's rows in df
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self.frame(['user']).groupby('user', sort=False, observed=True).indices
+        return self._rows
+
+    # dashboard counts for every user, computed on first use
+    @property
+    def aggregates(self):
+        if self._aggregates is None:
+            self._aggregates = Aggregates(self.df)
+        return self._aggregates
+
+    # word counts per user for the word cloud and top words
+    @property
+    def token_index(self):
+        if self._token_index is None:
+            self._token_index = TokenIndex(self.df)
+        return self._token_index
+
+    # reply times and conversation sessions, computed on first use
+    @property
+    def interactions(self):
+        if self._interactions is None:
+            self._interactions = Interactions(self.frame(['date', 'user', 'is_system']))
+        return self._interactions
+
+    # inverted index of the message words for the search panel
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.frame(['message', 'is_system', 'is_media', 'is_deleted']))
+        return self._search_index
+
+    # members of the chat as shown in the user picker
+    @property
+    def users(self):
+        if self._aggregates is not None:
+            users = self._aggregates.users.index
+        else:
+            users = self.rows
+        return sorted(user for user in users if user != 'group_notification')
+
+    # taken afresh on every call: kept copies of each user's rows would grow the chat
+    # well past the size the chat cache counted for it
+    def user_df(self, selected_user, columns=None):
+        if selected_user == 'Overall':
+            return self.frame(columns)
+        rows = self.rows.get(selected_user, np.array([], dtype=np.intp))
+        return self.frame(columns).take(rows)
+
+    # chat with `tail_df` appended as `df`, carrying the aggregates and token index
+    # forward by counting only the new messages
+    def extend(self, df, tail_df):
+        chat = Chat(df)
+        if self._aggregates is not None:
+            chat._aggregates = self._aggregates.extend(tail_df)
+        if self._token_index is not None:
+            chat._token_index = self._token_index.extend(tail_df)
+        return chat
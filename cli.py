@@ -0,0 +1,162 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import preprocessor
+import helper
+import export
+import ingest
+from chat import Chat
+
+FORMATS = ['json', 'parquet', 'excel', 'csv', 'pdf']
+
+
+# every .txt or .zip export under the given directories, plus files matched by the given globs
+def find_exports(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in ['*.txt', '*.zip']:
+                files.extend(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        else:
+            files.extend(glob.glob(path, recursive=True))
+    return sorted(set(os.path.abspath(file) for file in files))
+
+
+def _records(df):
+    return json.loads(df.to_json(orient='records', date_format='iso', force_ascii=False))
+
+
+# every aggregate the dashboard shows, for the whole chat and for each member
+def summarize(chat):
+    busy_users, busy_percent = helper.most_busy_users(chat)
+    summary = {
+        'users': chat.users,
+        'most_busy_users': busy_users.to_dict(),
+        'user_percent': _records(busy_percent),
+        'analysis': {},
+    }
+    for user in ['Overall'] + chat.users:
+        num_messages, num_words, num_media_messages, num_links = helper.fetch_stats(user, chat)
+        summary['analysis'][user] = {
+            'stats': {'messages': num_messages, 'words': num_words, 'media': num_media_messages,
+                      'links': num_links},
+            'monthly_timeline': _records(helper.monthly_timeline(user, chat)),
+            'daily_timeline': _records(helper.daily_timeline(user, chat)),
+            'week_activity': helper.week_activity_map(user, chat).to_dict(),
+            'month_activity': helper.month_activity_map(user, chat).to_dict(),
+            'activity_heatmap': json.loads(helper.activity_heatmap(user, chat).to_json()),
+            'most_common_words': helper.most_common_words(user, chat).values.tolist(),
+            'emojis': _records(helper.emoji_helper(user, chat)),
+            'shared_domains': _records(helper.most_shared_domains(user, chat)),
+            'sentiment': _records(helper.fetch_sentiment_stats(chat, user)),
+        }
+    return summary
+
+
+# parses one export on `workers` cores and writes its results; errors are returned
+# rather than raised so one broken file never stops the batch
+def analyse_file(path, out_prefix, formats, workers=1):
+    start = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            size = ingest.text_size(f)
+            with ingest.open_export(f) as binary:
+                chat = Chat(preprocessor.preprocess(ingest.chat_lines(binary), workers=workers, size=size))
+
+        os.makedirs(os.path.dirname(out_prefix), exist_ok=True)
+        if 'json' in formats:
+            with open(out_prefix + '.json', 'w', encoding='utf-8') as f:
+                json.dump(summarize(chat), f, ensure_ascii=False, default=str)
+        for fmt in formats:
+            if fmt != 'json':
+                export.writers[fmt](chat, 'Overall', out_prefix + export.FORMATS[fmt][0])
+
+        return {'file': path, 'ok': True, 'messages': len(chat.df), 'seconds': time.perf_counter() - start}
+    except Exception as error:
+        return {'file': path, 'ok': False, 'error': repr(error), 'seconds': time.perf_counter() - start}
+
+
+# analyses the files on a fresh pool, passing each result to `report`; returns the
+# files left unfinished when a worker process died and took the pool down
+def _run_pool(files, prefixes, formats, workers, report):
+    broken = set()
+    # cores a pool leaves spare go to splitting each large export
+    parse_workers = max(1, (os.cpu_count() or 1) // min(workers, len(files)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyse_file, file, prefixes[file], formats, parse_workers): file
+                   for file in files}
+        for future in as_completed(futures):
+            try:
+                report(future.result())
+            except BrokenProcessPool:
+                broken.add(futures[future])
+    return [file for file in files if file in broken]
+
+
+# a worker killed for memory or by a crash in native code breaks the whole pool, so
+# the unfinished files run again on a new one. When none finished, they run one at a
+# time, and the file whose worker dies then is recorded as failed
+def run_batch(files, prefixes, formats, workers, report):
+    pending = files
+    one_at_a_time = False
+    while pending:
+        start = time.perf_counter()
+        broken = _run_pool(pending, prefixes, formats, 1 if one_at_a_time else workers, report)
+        if one_at_a_time and broken:
+            report({'file': broken[0], 'ok': False, 'error': "the worker process died",
+                    'seconds': time.perf_counter() - start})
+            broken = broken[1:]
+            one_at_a_time = False
+        else:
+            one_at_a_time = len(broken) == len(pending)
+        pending = broken
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse exported WhatsApp chats without the Streamlit app.")
+    parser.add_argument('paths', nargs='+', help="directories of .txt or .zip exports or glob patterns")
+    parser.add_argument('-o', '--out', default='analysis', help="directory for the results (default: analysis)")
+    parser.add_argument('-f', '--format', nargs='+', choices=FORMATS, default=['json'], dest='formats',
+                        help="result formats to write per chat (default: json)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="files analysed in parallel (default: CPU count); spare cores "
+                             "split large files")
+    args = parser.parse_args(argv)
+
+    files = find_exports(args.paths)
+    if not files:
+        print("No chat exports found.", file=sys.stderr)
+        return 1
+
+    # results mirror the layout of the inputs below their common directory
+    root = os.path.commonpath([os.path.dirname(file) for file in files])
+    prefixes = {file: os.path.join(args.out, os.path.splitext(os.path.relpath(file, root))[0]) for file in files}
+
+    results = []
+
+    def report(result):
+        results.append(result)
+        status = f"{result['messages']} messages" if result['ok'] else f"FAILED {result['error']}"
+        print(f"[{len(results)}/{len(files)}] {os.path.relpath(result['file'], root)}: {status} "
+              f"({result['seconds']:.2f}s)", file=sys.stderr)
+
+    start = time.perf_counter()
+    run_batch(files, prefixes, args.formats, args.workers, report)
+
+    failed = [result for result in results if not result['ok']]
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, 'batch_report.json'), 'w', encoding='utf-8') as f:
+        json.dump({'files': len(files), 'failed': len(failed), 'seconds': time.perf_counter() - start,
+                   'results': sorted(results, key=lambda result: result['file'])}, f, indent=2)
+    print(f"Analysed {len(files) - len(failed)} of {len(files)} chats in {time.perf_counter() - start:.1f}s",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+import os
+import re
+import hashlib
+import tempfile
+import threading
+import time
+import helper
+import lazy
+
+xlsxwriter = lazy.module('xlsxwriter')
+pa = lazy.module('pyarrow')
+pq = lazy.module('pyarrow.parquet')
+canvas = lazy.module('reportlab.pdfgen.canvas')
+pagesizes = lazy.module('reportlab.lib.pagesizes')
+colors = lazy.module('reportlab.lib.colors')
+emoji = lazy.module('emoji')
+
+# finished exports, one directory per chat, least recently used deleted first once
+# together they take more than EXPORT_MAX_BYTES
+EXPORT_DIR = os.environ.get('CHAT_EXPORT_DIR') or os.path.join(
+    os.environ.get('CHAT_CACHE_DIR') or tempfile.gettempdir(), 'chat_exports')
+EXPORT_MAX_BYTES = int(os.environ.get('CHAT_EXPORT_MB', 2048)) * 1024 * 1024
+EXPORT_MIN_AGE = 60
+# rows converted and written at a time, so only one chunk is ever held as Python objects
+CHUNK_ROWS = 50_000
+# Excel's limit is 1,048,576 rows per sheet, one of them taken by the header
+SHEET_ROWS = 1_048_575
+
+FORMATS = {
+    'excel': ('.xlsx', "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    'csv': ('.csv.gz', "application/gzip"),
+    'parquet': ('.parquet', "application/vnd.apache.parquet"),
+    'pdf': ('.pdf', "application/pdf"),
+}
+FORMAT_LABELS = {'excel': "Excel", 'csv': "CSV (gzip)", 'parquet': "Parquet", 'pdf': "PDF"}
+# formats holding the messages themselves rather than a printed report
+DATA_FORMATS = ['excel', 'csv', 'parquet']
+# rows listed in the report's word and emoji charts
+PDF_TOP = 15
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+# file name for a user: readable where possible, with a hash so names never collide
+def _user_slug(selected_user):
+    name = re.sub(r'[^\w.-]+', '_', selected_user).strip('_')[:40]
+    return f"{name}-{hashlib.sha1(selected_user.encode()).hexdigest()[:8]}"
+
+
+def export_path(chat_hash, selected_user, fmt):
+    return os.path.join(EXPORT_DIR, chat_hash, _user_slug(selected_user) + FORMATS[fmt][0])
+
+
+def _chunks(df):
+    for start in range(0, len(df), CHUNK_ROWS):
+        yield df.iloc[start:start + CHUNK_ROWS]
+
+
+# rows of a chunk as plain Python values, which is what xlsxwriter understands; dates
+# that failed to parse and their nullable date parts become empty cells
+def _rows(chunk):
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    return zip(*(chunk[column].tolist() for column in chunk.columns))
+
+
+def _summary_tables(selected_user, chat):
+    num_messages, num_words, num_media_messages, num_links = helper.fetch_stats(selected_user, chat)
+    tables = {
+        'Summary': (['Statistic', 'Value'], [
+            ['User', selected_user], ['Messages', num_messages], ['Words', num_words],
+            ['Media shared', num_media_messages], ['Links shared', num_links]]),
+    }
+    if selected_user == 'Overall':
+        _, percent = helper.most_busy_users(chat)
+        tables['Users'] = (['User', 'Percent'], percent.values.tolist())
+    timeline = helper.monthly_timeline(selected_user, chat)
+    tables['Monthly'] = (['Month', 'Messages'], timeline[['time', 'message']].values.tolist())
+    sentiment_counts = helper.fetch_sentiment_stats(chat, selected_user)
+    tables['Sentiment'] = (['Sentiment', 'Messages'], sentiment_counts.values.tolist())
+    return tables
+
+
+def _write_rows(sheet, header, rows, formats):
+    sheet.write_row(0, 0, header, formats['header'])
+    for row_number, row in enumerate(rows, 1):
+        sheet.write_row(row_number, 0, row)
+
+
+# summary sheets from the aggregates first, then the messages streamed in chunks,
+# starting a new sheet whenever one is full
+def write_excel(chat, selected_user, target):
+    # constant_memory flushes each row to disk as soon as the next one starts
+    workbook = xlsxwriter.Workbook(target, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'strings_to_formulas': False,
+        'default_date_format': 'yyyy-mm-dd hh:mm',
+    })
+    formats = {'header': workbook.add_format({'bold': True})}
+
+    for name, (header, rows) in _summary_tables(selected_user, chat).items():
+        _write_rows(workbook.add_worksheet(name), header, rows, formats)
+
+    df = helper.user_messages(selected_user, chat)
+    header = list(df.columns)
+    sheet, row_number, sheets = None, SHEET_ROWS, 0
+    for chunk in _chunks(df):
+        for row in _rows(chunk):
+            if row_number == SHEET_ROWS:
+                sheets += 1
+                sheet = workbook.add_worksheet("Messages" if sheets == 1 else f"Messages {sheets}")
+                sheet.write_row(0, 0, header, formats['header'])
+                row_number = 0
+            row_number += 1
+            sheet.write_row(row_number, 0, row)
+    if sheet is None:
+        workbook.add_worksheet("Messages").write_row(0, 0, header, formats['header'])
+    workbook.close()
+
+
+def write_csv(chat, selected_user, target):
+    df = helper.user_messages(selected_user, chat)
+    df.to_csv(target, index=False, compression='gzip', chunksize=CHUNK_ROWS)
+
+
+def write_parquet(chat, selected_user, target):
+    df = helper.user_messages(selected_user, chat)
+    writer = None
+    for chunk in _chunks(df) if len(df) else [df]:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(target, table.schema)
+        writer.write_table(table)
+    writer.close()
+
+
+# text the standard PDF fonts can draw: emojis by name, anything else outside cp1252 as '?'
+def _pdf_text(value):
+    return emoji.demojize(str(value)).encode('cp1252', 'replace').decode('cp1252')
+
+
+def _title(pdf, x, y, text):
+    pdf.setFont('Helvetica-Bold', 11)
+    pdf.drawString(x, y, _pdf_text(text))
+    pdf.setFont('Helvetica', 7)
+
+
+# charts are drawn as vector paths straight onto the page, (x, y) is the bottom left
+# of the plot area and the title sits above it
+def _bar_chart(pdf, x, y, width, height, title, labels, values):
+    _title(pdf, x, y + height + 8, title)
+    if not len(values):
+        return
+    top = max(max(values), 1)
+    step = width / len(values)
+    pdf.setFillColor(colors.HexColor('#4c72b0'))
+    for i, value in enumerate(values):
+        pdf.rect(x + i * step + step * 0.1, y, step * 0.8, height * value / top, stroke=0, fill=1)
+    pdf.setFillColor(colors.black)
+    for i, label in enumerate(labels):
+        pdf.drawCentredString(x + i * step + step / 2, y - 9, _pdf_text(label)[:10])
+    pdf.drawRightString(x - 3, y + height - 3, str(top))
+
+
+def _barh_chart(pdf, x, y, width, height, title, labels, values):
+    _title(pdf, x, y + height + 8, title)
+    if not len(values):
+        return
+    top = max(max(values), 1)
+    step = height / len(values)
+    label_width = 80
+    for i, (label, value) in enumerate(zip(labels, values)):
+        row_y = y + height - (i + 1) * step
+        pdf.setFillColor(colors.black)
+        pdf.drawRightString(x + label_width - 4, row_y + step * 0.3, _pdf_text(label)[:24])
+        pdf.setFillColor(colors.HexColor('#55a868'))
+        bar_width = (width - label_width - 30) * value / top
+        pdf.rect(x + label_width, row_y + step * 0.1, bar_width, step * 0.8, stroke=0, fill=1)
+        pdf.setFillColor(colors.black)
+        pdf.drawString(x + label_width + bar_width + 3, row_y + step * 0.3, str(value))
+
+
+def _line_chart(pdf, x, y, width, height, title, labels, values):
+    _title(pdf, x, y + height + 8, title)
+    if not len(values):
+        return
+    top = max(max(values), 1)
+    step = width / max(len(values) - 1, 1)
+    pdf.setStrokeColor(colors.grey)
+    pdf.line(x, y, x + width, y)
+    pdf.setStrokeColor(colors.HexColor('#4c72b0'))
+    path = pdf.beginPath()
+    path.moveTo(x, y + height * values[0] / top)
+    for i, value in enumerate(values[1:], 1):
+        path.lineTo(x + i * step, y + height * value / top)
+    pdf.drawPath(path, stroke=1, fill=0)
+    pdf.setStrokeColor(colors.black)
+    pdf.drawString(x, y - 9, _pdf_text(labels[0]))
+    pdf.drawRightString(x + width, y - 9, _pdf_text(labels[-1]))
+    pdf.drawRightString(x - 3, y + height - 3, str(top))
+
+
+def _heatmap(pdf, x, y, width, height, title, table):
+    _title(pdf, x, y + height + 8, title)
+    if table.empty:
+        return
+    label_width = 50
+    cell_width = (width - label_width) / len(table.columns)
+    cell_height = height / len(table.index)
+    top = max(table.values.max(), 1)
+    for row, day in enumerate(table.index):
+        row_y = y + height - (row + 1) * cell_height
+        pdf.setFillColor(colors.black)
+        pdf.drawRightString(x + label_width - 4, row_y + cell_height * 0.3, _pdf_text(day))
+        for column, value in enumerate(table.iloc[row]):
+            shade = 1 - 0.85 * value / top
+            pdf.setFillColorRGB(shade, shade, 1)
+            pdf.rect(x + label_width + column * cell_width, row_y, cell_width, cell_height, stroke=0, fill=1)
+    pdf.setFillColor(colors.black)
+    for column, period in enumerate(table.columns):
+        if column % 2 == 0:
+            pdf.drawCentredString(x + label_width + (column + 0.5) * cell_width, y - 9, _pdf_text(period))
+
+
+def _table(pdf, x, y, title, rows, column_x):
+    _title(pdf, x, y + 8, title)
+    pdf.setFont('Helvetica', 9)
+    for i, row in enumerate(rows):
+        for offset, value in zip(column_x, row):
+            pdf.drawString(x + offset, y - (i + 1) * 13, _pdf_text(value))
+
+
+# one to two pages of statistics and charts for a user, all taken from the chat's
+# aggregates and word counts, so the report costs the same for any chat size
+def write_pdf(chat, selected_user, target):
+    page_width, page_height = pagesizes.letter
+    pdf = canvas.Canvas(target, pagesize=pagesizes.letter, pageCompression=1)
+    pdf.setTitle("WhatsApp Chat Analysis")
+    left, chart_width = 60, page_width - 110
+
+    pdf.setFont('Helvetica-Bold', 18)
+    pdf.drawString(left, page_height - 60, "WhatsApp Chat Analysis")
+    pdf.setFont('Helvetica', 11)
+    pdf.drawString(left, page_height - 80, _pdf_text(f"Report for: {selected_user}"))
+
+    num_messages, num_words, num_media_messages, num_links = helper.fetch_stats(selected_user, chat)
+    _table(pdf, left, page_height - 120, "Statistics",
+           [["Messages", num_messages], ["Words", num_words], ["Media shared", num_media_messages],
+            ["Links shared", num_links]], [0, 110])
+
+    sentiment_counts = helper.fetch_sentiment_stats(chat, selected_user)
+    total = max(sentiment_counts['Count'].sum(), 1)
+    _table(pdf, left + 260, page_height - 120, "Sentiment",
+           [[row.Sentiment, row.Count, f"{row.Count * 100 / total:.1f}%"]
+            for row in sentiment_counts.itertuples()], [0, 70, 130])
+
+    if selected_user == 'Overall':
+        _, percent = helper.most_busy_users(chat)
+        _barh_chart(pdf, left, page_height - 370, chart_width, 160, "Most Busy Users",
+                    percent['name'].head(10).tolist(), percent['percent'].head(10).tolist())
+
+    timeline = helper.monthly_timeline(selected_user, chat)
+    _line_chart(pdf, left, 300, chart_width, 90, "Monthly Timeline",
+                timeline['time'].tolist(), timeline['message'].tolist())
+    daily = helper.daily_timeline(selected_user, chat)
+    _line_chart(pdf, left, 80, chart_width, 90, "Daily Timeline",
+                daily['only_date'].tolist(), daily['message'].tolist())
+    pdf.showPage()
+
+    busy_day = helper.week_activity_map(selected_user, chat)
+    _bar_chart(pdf, left, page_height - 170, chart_width / 2 - 20, 100, "Most Busy Day",
+               busy_day.index.tolist(), busy_day.tolist())
+    busy_month = helper.month_activity_map(selected_user, chat)
+    _bar_chart(pdf, left + chart_width / 2 + 20, page_height - 170, chart_width / 2 - 20, 100, "Most Busy Month",
+               [month[:3] for month in busy_month.index], busy_month.tolist())
+    _heatmap(pdf, left, page_height - 370, chart_width, 150, "Weekly Activity Map",
+             helper.activity_heatmap(selected_user, chat))
+
+    words = helper.most_common_words(selected_user, chat).head(PDF_TOP)
+    _barh_chart(pdf, left, 70, chart_width / 2 - 10, 250, "Most Common Words",
+                words[0].tolist(), words[1].tolist())
+    emojis = helper.emoji_helper(selected_user, chat).head(PDF_TOP)
+    _barh_chart(pdf, left + chart_width / 2 + 10, 70, chart_width / 2 - 10, 250, "Top Emojis",
+                emojis['emoji'].tolist(), emojis['count'].tolist())
+    pdf.showPage()
+    pdf.save()
+
+
+writers = {'excel': write_excel, 'csv': write_csv, 'parquet': write_parquet, 'pdf': write_pdf}
+
+
+# deletes the least recently used exports until the rest fit in max_bytes; files used in
+# the last EXPORT_MIN_AGE seconds are being written or handed out and are left alone
+def prune_exports(max_bytes=None):
+    max_bytes = EXPORT_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    for root, _, names in os.walk(EXPORT_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    recent = time.time() - EXPORT_MIN_AGE
+    for used, size, path in sorted(files):
+        if total <= max_bytes or used > recent:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# path of the chat's export in the given format, written on the first request for
+# that chat and user and reused afterwards
+def export_chat(chat, chat_hash, selected_user, fmt):
+    path = export_path(chat_hash, selected_user, fmt)
+    with _lock(path):
+        if os.path.exists(path):
+            # reused, so it is the most recently used export again
+            os.utime(path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        try:
+            writers[fmt](chat, selected_user, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    prune_exports()
+    return path
@@ -0,0 +1,139 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+import numpy as np
+import pandas as pd
+import lazy
+
+emoji = lazy.module('emoji')
+urlextract = lazy.module('urlextract')
+
+
+# regex alternation laid out as a trie so each position is tried against one branch
+# per character instead of every emoji, and longer sequences (ZWJ families, skin
+# tones, flags, keycaps) win over the single code points they start with
+def _trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = '(?:' + '|'.join(branches) + ')' if len(branches) > 1 else branches[0]
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+
+# compact class of the given characters written as code point ranges
+def _char_class(chars):
+    ranges = []
+    for point in sorted({ord(char) for char in chars}):
+        if ranges and point == ranges[-1][1] + 1:
+            ranges[-1][1] = point
+        else:
+            ranges.append([point, point])
+    return '[' + ''.join(re.escape(chr(start)) if start == end else re.escape(chr(start)) + '-' + re.escape(chr(end))
+                         for start, end in ranges) + ']'
+
+
+# the lookahead rejects positions that cannot start an emoji before the trie is tried;
+# compiled on first use since it is built from the whole emoji table
+@lru_cache(maxsize=None)
+def emoji_pattern():
+    return re.compile('(?=' + _char_class(key[0] for key in emoji.EMOJI_DATA) + ')'
+                      + _trie_pattern(emoji.EMOJI_DATA))
+
+
+# every emoji has a non-ASCII code point, so plain ASCII messages are never searched
+non_ascii_pattern = r'[^\x00-\x7f]'
+
+
+# per-message 'emojis' (space separated, in order of use) and 'emoji_count' columns
+def add_emoji_columns(df):
+    messages = df['message']
+    candidates = messages.str.contains(non_ascii_pattern, regex=True).fillna(False).to_numpy(dtype=bool)
+    found = messages[candidates].str.findall(emoji_pattern())
+
+    emojis = np.full(len(df), '', dtype=object)
+    emojis[candidates] = found.str.join(' ').to_numpy(dtype=object)
+    # int32 like word_count, a message of pasted emoji can pass int16's 32,767
+    counts = np.zeros(len(df), dtype='int32')
+    counts[candidates] = found.str.len().to_numpy()
+
+    df['emojis'] = pd.Series(emojis, index=df.index, dtype=str)
+    df['emoji_count'] = counts
+    return df
+
+
+# URLExtract loads its TLD list when built, so it is only created once a chat has candidate links
+_url_extractor = None
+
+
+def url_extractor():
+    global _url_extractor
+    if _url_extractor is None:
+        _url_extractor = urlextract.URLExtract()
+    return _url_extractor
+
+
+# a link needs a scheme or a dot followed by a TLD-like word; messages without
+# either are never handed to URLExtract
+link_candidate_pattern = r'https?://|\.[^\W\d_]{2,}'
+
+
+def link_domain(url):
+    if '://' not in url:
+        url = 'http://' + url
+    host = urlsplit(url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+# per-message 'link_count' and 'link_domains' (space separated) columns
+def add_link_columns(df):
+    messages = df['message']
+    candidates = messages.str.contains(link_candidate_pattern, regex=True).fillna(False).to_numpy(dtype=bool)
+
+    domains = np.full(len(df), '', dtype=object)
+    counts = np.zeros(len(df), dtype='int32')
+    if candidates.any():
+        extract = url_extractor()
+        for row, message in zip(np.flatnonzero(candidates), messages[candidates]):
+            urls = extract.find_urls(message)
+            counts[row] = len(urls)
+            domains[row] = ' '.join(link_domain(url) for url in urls)
+
+    df['link_count'] = counts
+    df['link_domains'] = pd.Series(domains, index=df.index, dtype=str)
+    return df
+
+
+# placeholders WhatsApp writes instead of the content: "<Media omitted>" on Android,
+# "image omitted" / "<attached: ...>" on iOS, optionally behind a left-to-right mark
+media_pattern = ('^\u200e?' r'\s*(?:<Media omitted>|<attached: [^>]*>'
+                 r'|.*\b(?:image|video|audio|sticker|GIF|document|Contact card) omitted)\s*$')
+deleted_pattern = '^\u200e?' r'\s*(?:This message was deleted|You deleted this message)\.?\s*$'
+
+
+# per-message 'is_system', 'is_media', 'is_deleted', 'word_count' and 'char_count'
+def add_message_columns(df):
+    messages = df['message']
+
+    df['is_system'] = (df['user'] == 'group_notification').to_numpy(dtype=bool)
+    df['is_media'] = messages.str.match(media_pattern, case=False).fillna(False).to_numpy(dtype=bool)
+    df['is_deleted'] = messages.str.match(deleted_pattern, case=False).fillna(False).to_numpy(dtype=bool)
+
+    # placeholders are not words the user typed
+    placeholder = df['is_media'].to_numpy() | df['is_deleted'].to_numpy()
+    word_count = messages.str.count(r'\S+').fillna(0).to_numpy(dtype='int32')
+    word_count[placeholder] = 0
+    df['word_count'] = word_count
+
+    # length of the text without the line break that ends every message
+    df['char_count'] = (messages.str.len() - messages.str.endswith('\n')).fillna(0).to_numpy(dtype='int32')
+    return df
@@ -1,166 +1,148 @@
-from urlextract import URLExtract
-from wordcloud import WordCloud
-import pandas as pd
-from collections import Counter
-import emoji
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from io import BytesIO
+from chat import Chat
+from aggregates import Aggregates
+from interactions import Interactions
+import search
+import tokenizer
+import lazy
 
+wordcloud = lazy.module('wordcloud')
 
-extract = URLExtract()
-
-def fetch_stats(selected_user,df):
 
+# rows of the selected user, taken from the chat's user index when one is passed
+def user_messages(selected_user, df, columns=None):
+    if isinstance(df, Chat):
+        return df.user_df(selected_user, columns)
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
+    return df
+
+# precomputed dashboard aggregates of a chat, or computed on the spot for a plain frame
+def chat_aggregates(df):
+    if isinstance(df, Chat):
+        return df.aggregates
+    return Aggregates(df)
+
+def chat_interactions(df):
+    if isinstance(df, Chat):
+        return df.interactions
+    return Interactions(df)
+
+def fetch_stats(selected_user,df):
+
+    df = user_messages(selected_user, df, ['word_count', 'is_media', 'link_count'])
     # fetch the number of messages
     num_messages = df.shape[0]
 
     # fetch the total number of words
-    words = []
-    for message in df['message']:
-        words.extend(message.split())
+    num_words = int(df['word_count'].sum())
 
     # fetch number of media messages
-    num_media_messages = df[df['message'] == '<Media omitted>\n'].shape[0]
+    num_media_messages = int(df['is_media'].sum())
 
     # fetch number of links shared
-    links = []
-    for message in df['message']:
-        links.extend(extract.find_urls(message))
+    num_links = int(df['link_count'].sum())
 
-    return num_messages,len(words),num_media_messages,len(links)
+    return num_messages,num_words,num_media_messages,num_links
 
-def most_busy_users(df):
-    x = df['user'].value_counts().head()
-    df = round((df['user'].value_counts() / df.shape[0]) * 100, 2).reset_index().rename(
-        columns={'index': 'name', 'user': 'percent'})
-    return x,df
-
-def create_wordcloud(selected_user,df):
+# domains of the links shared, most frequent first
+def most_shared_domains(selected_user,df):
+    df = user_messages(selected_user, df, ['link_count', 'link_domains'])
 
-    f = open('stop_hinglish.txt', 'r')
-    stop_words = f.read()
+    domains = df.loc[df['link_count'] > 0, 'link_domains'].str.split().explode()
+    domain_counts = domains.value_counts().reset_index()
+    domain_counts.columns = ['domain', 'count']
+    return domain_counts
 
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+def most_busy_users(df):
+    return chat_aggregates(df).most_busy_users()
 
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
+# word counts from the chat's token index, rebuilt only for a custom stop-word list
+def chat_tokens(selected_user, df, stop_words=None):
+    if isinstance(df, Chat) and stop_words is None:
+        return df.token_index
+    return tokenizer.TokenIndex(user_messages(selected_user, df), stop_words)
 
-    def remove_stop_words(message):
-        y = []
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
+def create_wordcloud(selected_user,df,stop_words=None):
 
-    wc = WordCloud(width=500,height=500,min_font_size=10,background_color='white')
-    temp['message'] = temp['message'].apply(remove_stop_words)
-    df_wc = wc.generate(temp['message'].str.cat(sep=" "))
+    wc = wordcloud.WordCloud(width=500,height=500,min_font_size=10,background_color='white')
+    frequencies = chat_tokens(selected_user, df, stop_words).frequencies(selected_user)
+    df_wc = wc.generate_from_frequencies(frequencies.head(wc.max_words).to_dict())
     return df_wc
 
-def most_common_words(selected_user,df):
-
-    f = open('stop_hinglish.txt','r')
-    stop_words = f.read()
-
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    temp = df[df['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
-
-    words = []
-
-    for message in temp['message']:
-        for word in message.lower().split():
-            if word not in stop_words:
-                words.append(word)
-
-    most_common_df = pd.DataFrame(Counter(words).most_common(20))
-    return most_common_df
+def most_common_words(selected_user,df,stop_words=None):
+    return chat_tokens(selected_user, df, stop_words).most_common(selected_user)
 
 def emoji_helper(selected_user,df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+    df = user_messages(selected_user, df, ['emoji_count', 'emojis'])
 
-    emojis = []
-    for message in df['message']:
-        emojis.extend([c for c in message if c in emoji.EMOJI_DATA])
-
-    emoji_counts = pd.DataFrame(Counter(emojis).most_common(), columns=['emoji', 'count'])
+    emojis = df.loc[df['emoji_count'] > 0, 'emojis'].str.split().explode()
+    emoji_counts = emojis.value_counts().reset_index()
+    emoji_counts.columns = ['emoji', 'count']
     return emoji_counts
 
 def monthly_timeline(selected_user,df):
-
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-
-    time = []
-    for i in range(timeline.shape[0]):
-        time.append(timeline['month'][i] + "-" + str(timeline['year'][i]))
-
-    timeline['time'] = time
-
-    return timeline
+    return chat_aggregates(df).monthly_timeline(selected_user)
 
 # Dali Timeline
 def daily_timeline(selected_user,df):
-
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    daily_timeline = df.groupby('only_date').count()['message'].reset_index()
-
-    return daily_timeline
+    return chat_aggregates(df).daily_timeline(selected_user)
 
 def week_activity_map(selected_user,df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    return df['day_name'].value_counts()
+    return chat_aggregates(df).week_activity_map(selected_user)
 
 def month_activity_map(selected_user,df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    return df['month'].value_counts()
+    return chat_aggregates(df).month_activity_map(selected_user)
 
 def activity_heatmap(selected_user,df):
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
-
-    user_heatmap = df.pivot_table(index='day_name', columns='period', values='message', aggfunc='count').fillna(0)
-    return user_heatmap
+    return chat_aggregates(df).activity_heatmap(selected_user)
 
 
 # sentiment Analysis
 def fetch_sentiment_stats(df, selected_user):
-    sentiment_df = df[df['user'] == selected_user] if selected_user != "Overall" else df
-    sentiment_count = sentiment_df['sentiment_category'].value_counts().reset_index()
-    sentiment_count.columns = ['Sentiment', 'Count']
-    return sentiment_count
+    return chat_aggregates(df).sentiment_counts(selected_user)
 
 # Function to fetch overall sentiment counts
 def sentiment_analysis(df):
-    sentiment_count = df['sentiment_category'].value_counts().reset_index()
-    sentiment_count.columns = ['Sentiment', 'Count']
-    return sentiment_count
-
-# Generate Excel
-def generate_excel(dataframe):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        dataframe.to_excel(writer, index=False, sheet_name="Chat Analysis")
-    output.seek(0)
-    return output
-
-
-
-
-
+    return chat_aggregates(df).sentiment_counts('Overall')
+
+# mean sentiment per day, from the aggregates
+def sentiment_timeline(selected_user, df):
+    return chat_aggregates(df).sentiment_timeline(selected_user)
+
+# the n most positive and most negative messages beyond the threshold; nlargest and
+# nsmallest select them from the user's slice without sorting or copying it
+def top_sentiment_messages(selected_user, df, n=5, threshold=0.5):
+    messages = user_messages(selected_user, df, ['message', 'sentiment'])
+    positive = messages.nlargest(n, 'sentiment')
+    negative = messages.nsmallest(n, 'sentiment')
+    return positive[positive['sentiment'] > threshold], negative[negative['sentiment'] < -threshold]
+
+# median and 90th percentile reply time in minutes, per member, or for one member per
+# person they replied to
+def reply_times(selected_user, df):
+    stats = chat_interactions(df).reply_times(selected_user)
+    stats[['median_seconds', 'p90_seconds']] = (stats[['median_seconds', 'p90_seconds']] / 60).round(1)
+    return stats.rename(columns={'median_seconds': 'median_minutes', 'p90_seconds': 'p90_minutes'})
+
+# median minutes each member (rows) takes to reply to each other member (columns)
+def reply_matrix(df):
+    return (chat_interactions(df).reply_matrix() / 60).round(1)
+
+# number of conversations, their median length in minutes and mean message count;
+# for one member also how many they started and ended
+def conversation_summary(selected_user, df):
+    return chat_interactions(df).session_summary(selected_user)
+
+# conversations started and ended by each member
+def conversation_starters(df):
+    return chat_interactions(df).starters()
+
+# row ids of the messages matching a search query, see search.parse_query
+def search_messages(selected_user, df, query, start=None, end=None):
+    return search.search(df, query, selected_user, start, end)
+
+def search_page_count(hits, page_size=search.PAGE_SIZE):
+    return search.page_count(hits, page_size)
+
+def search_results(df, hits, page, page_size=search.PAGE_SIZE):
+    return search.results_page(df, hits, page, page_size)
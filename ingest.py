@@ -0,0 +1,76 @@
+import io
+import os
+import zipfile
+from contextlib import contextmanager
+
+# bytes read from an upload at a time
+CHUNK_BYTES = 1024 * 1024
+ZIP_MAGIC = b'PK\x03\x04'
+
+
+# the chat inside a zip export: iOS names it _chat.txt, Android after the chat
+def _chat_member(archive):
+    texts = [info for info in archive.infolist()
+             if not info.is_dir() and info.filename.lower().endswith('.txt')
+             and not os.path.basename(info.filename).startswith('.')]
+    if not texts:
+        raise ValueError("The zip file does not contain a chat .txt file.")
+    for info in texts:
+        if os.path.basename(info.filename) == '_chat.txt':
+            return info
+    return max(texts, key=lambda info: info.file_size)
+
+
+def _rewound(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    source.seek(0)
+    is_zip = source.read(len(ZIP_MAGIC)) == ZIP_MAGIC
+    source.seek(0)
+    return source, is_zip
+
+
+def _archive(source):
+    try:
+        return zipfile.ZipFile(source)
+    except zipfile.BadZipFile as error:
+        raise ValueError(f"The zip file could not be read: {error}") from error
+
+
+# the export's chat text as a binary stream: the upload itself, or the chat file of a
+# zip export decompressed as it is read. The upload is left open and can be read again.
+@contextmanager
+def open_export(source):
+    source, is_zip = _rewound(source)
+    if not is_zip:
+        yield source
+        return
+    with _archive(source) as archive, archive.open(_chat_member(archive)) as member:
+        yield member
+
+
+# bytes of chat text in an export without reading it: the upload's length, or the
+# uncompressed size the zip records for its chat file
+def text_size(source):
+    source, is_zip = _rewound(source)
+    if not is_zip:
+        return source.seek(0, io.SEEK_END)
+    with _archive(source) as archive:
+        return _chat_member(archive).file_size
+
+
+# lines of an export stream decoded a chunk at a time: a leading BOM is dropped, invalid
+# bytes become U+FFFD and lines split on '\n' only, as preprocessor.iter_lines does for a str
+def chat_lines(binary):
+    text = io.TextIOWrapper(binary, encoding='utf-8-sig', errors='replace', newline='\n')
+    try:
+        yield from text
+    finally:
+        # leave the stream open for the caller
+        if not binary.closed:
+            text.detach()
+
+
+def read_chunks(binary, size=None):
+    size = size or CHUNK_BYTES
+    return iter(lambda: binary.read(size), b'')
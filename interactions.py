@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pandas as pd
+
+# a silence longer than this ends a conversation, the next message starts a new one
+SESSION_GAP = pd.Timedelta(minutes=int(os.environ.get('SESSION_GAP_MINUTES', 60)))
+
+
+def _percentiles(seconds, keys):
+    grouped = seconds.groupby(keys, observed=True)
+    stats = grouped.agg(['size', 'median'])
+    stats['p90'] = grouped.quantile(0.9)
+    stats.columns = ['replies', 'median_seconds', 'p90_seconds']
+    return stats
+
+
+# reply times and conversation sessions of a chat, computed with array operations over
+# its time-ordered date and user columns; system notices and messages whose date
+# failed to parse are left out
+class Interactions:
+
+    def __init__(self, df, gap=SESSION_GAP):
+        keep = ~(df['is_system'] | df['date'].isna()).to_numpy()
+        dates = df['date'].to_numpy()[keep]
+        codes, names = pd.factorize(df['user'].to_numpy()[keep])
+        self.names = pd.Index(names, dtype=object)
+
+        gaps = np.diff(dates)
+        new_session = np.concatenate([[True], gaps > gap.to_timedelta64()]) if len(dates) else np.array([], bool)
+
+        # a reply is a message within the same session whose sender differs from the
+        # previous message's; its latency is measured from that previous message
+        reply = ~new_session[1:] & (codes[1:] != codes[:-1])
+        self.replies = pd.DataFrame({
+            'responder': self._users(codes[1:][reply]),
+            'replied_to': self._users(codes[:-1][reply]),
+            # lines an export wrote slightly out of order count as instant replies
+            'seconds': np.maximum(gaps[reply] / np.timedelta64(1, 's'), 0),
+        })
+
+        starts = np.flatnonzero(new_session)
+        ends = np.append(starts[1:] - 1, len(dates) - 1) if len(starts) else starts
+        session_ids = np.cumsum(new_session) - 1
+        participants = (pd.DataFrame({'session': session_ids, 'user': codes})
+                        .drop_duplicates().groupby('session').size().to_numpy())
+        self.sessions = pd.DataFrame({
+            'start': dates[starts],
+            'end': dates[ends],
+            'messages': np.diff(np.append(starts, len(dates))),
+            'participants': participants,
+            'starter': self._users(codes[starts]),
+            'ender': self._users(codes[ends]),
+        })
+        self.sessions['minutes'] = (self.sessions['end'] - self.sessions['start']) / pd.Timedelta(minutes=1)
+        # (session, user) pairs, so a member's sessions are found without the messages
+        self.members = pd.DataFrame({'session': session_ids, 'user': self._users(codes)}).drop_duplicates()
+
+    @property
+    def nbytes(self):
+        return sum(int(table.memory_usage(deep=True).sum()) for table in [self.replies, self.sessions, self.members])
+
+    def _users(self, codes):
+        return pd.Categorical.from_codes(codes, categories=self.names)
+
+    # median and 90th percentile time to reply, per responder or, for a user,
+    # per member they replied to
+    def reply_times(self, selected_user):
+        if selected_user == 'Overall':
+            stats = _percentiles(self.replies['seconds'], self.replies['responder'])
+        else:
+            replies = self.replies[self.replies['responder'] == selected_user]
+            stats = _percentiles(replies['seconds'], replies['replied_to'])
+        stats.index.name = 'user'
+        return stats.sort_values('replies', ascending=False).reset_index()
+
+    # responder x replied-to table of median reply times
+    def reply_matrix(self):
+        return _percentiles(self.replies['seconds'], [self.replies['responder'], self.replies['replied_to']])[
+            'median_seconds'].unstack()
+
+    def user_sessions(self, selected_user):
+        if selected_user == 'Overall':
+            return self.sessions
+        return self.sessions.iloc[self.members.loc[self.members['user'] == selected_user, 'session'].to_numpy()]
+
+    # how many conversations each member started and ended
+    def starters(self):
+        started = self.sessions['starter'].value_counts().rename('started')
+        ended = self.sessions['ender'].value_counts().rename('ended')
+        counts = pd.concat([started, ended], axis=1).fillna(0).astype(int)
+        counts.index.name = 'user'
+        return counts.sort_values('started', ascending=False).reset_index()
+
+    def session_summary(self, selected_user):
+        sessions = self.user_sessions(selected_user)
+        summary = {
+            'sessions': len(sessions),
+            'median_minutes': float(sessions['minutes'].median()) if len(sessions) else 0.0,
+            'mean_messages': float(sessions['messages'].mean()) if len(sessions) else 0.0,
+        }
+        if selected_user != 'Overall':
+            summary['started'] = int((sessions['starter'] == selected_user).sum())
+            summary['ended'] = int((sessions['ender'] == selected_user).sum())
+        return summary
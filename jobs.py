@@ -0,0 +1,204 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cache
+import ingest
+
+# uploads parsed at the same time, each in a process of its own
+MAX_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# jobs running or waiting; further uploads are turned away until one finishes
+MAX_JOBS = int(os.environ.get('JOB_QUEUE', 8))
+# largest export a single job accepts
+MAX_UPLOAD_BYTES = int(os.environ.get('JOB_MAX_MB', 1024)) * 1024 * 1024
+# cores each job may use, a large export is split across them
+PARSE_WORKERS = int(os.environ.get('JOB_PARSE_WORKERS', max(1, (os.cpu_count() or 1) // MAX_WORKERS)))
+
+STAGES = ['queued', 'parse', 'sentiment', 'aggregates', 'store', 'done']
+
+
+class JobRejected(Exception):
+    pass
+
+
+# runs in a worker process: parses the spooled export through a chat cache of its own,
+# which writes the result to the shared chat store when there is one. previous is the
+# app's copy of an earlier export of the chat when there is no store to find it in,
+# so a longer re-export only parses the new messages
+def _run(path, directory, progress, keys, previous=None):
+    def report(stage):
+        progress[keys[0]] = stage
+
+    chat_cache = cache.ChatCache(max_bytes=0, directory=directory)
+    try:
+        with open(path, 'rb') as f:
+            _, chat = chat_cache.load(f, workers=PARSE_WORKERS, progress=report, keys=keys,
+                                      previous=previous)
+    finally:
+        os.remove(path)
+    # a stored chat is opened from the store by the app; one that is not there, because
+    # there is no store or writing to it failed, is sent back
+    return None if chat_cache.stored(keys[0]) else chat
+
+
+# one upload being parsed; every session uploading the same export shares it
+class Job:
+
+    def __init__(self, key, fingerprint=None, size=0, progress=None, chat=None, path=None):
+        self.key = key
+        self.path = path
+        self.fingerprint = fingerprint
+        self.size = size
+        self.progress = progress
+        self.chat = chat
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.chat is not None or self.error is not None
+
+    @property
+    def stage(self):
+        if self.chat is not None:
+            return 'done'
+        if self.error is not None:
+            return 'failed'
+        return self.progress.get(self.key, 'queued')
+
+    # share of the stages passed, for a progress bar
+    @property
+    def fraction(self):
+        stage = self.stage
+        if stage not in STAGES:
+            return 1.0
+        return STAGES.index(stage) / (len(STAGES) - 1)
+
+
+# parse jobs run on a process pool with admission control: a size limit per upload
+# and a bound on the jobs running or waiting at once
+class JobQueue:
+
+    def __init__(self, max_workers=MAX_WORKERS, max_jobs=MAX_JOBS, max_bytes=MAX_UPLOAD_BYTES,
+                 chat_cache=None):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.chat_cache = chat_cache or cache.chat_cache
+        self.jobs = {}
+        # re-entrant, a job finishing before submit returns runs its callback in place
+        self.lock = threading.RLock()
+        self._pool = None
+        self._progress = None
+
+    # workers are spawned rather than forked, forking the threaded Streamlit server is unsafe
+    def _start(self):
+        context = multiprocessing.get_context('spawn')
+        if self._progress is None:
+            # stage names written by the workers, read by the page while it polls
+            self._progress = context.Manager().dict()
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+
+    # cache.source_keys of an upload, hashed only once its size is known to be within
+    # the limit: the size comes from the file's length or the size a zip records, so
+    # an oversized export or a zip bomb is turned away without being read
+    def upload_keys(self, source):
+        size = ingest.text_size(source)
+        if size > self.max_bytes:
+            raise JobRejected(self._too_large(size))
+        return cache.source_keys(source)
+
+    def _too_large(self, size):
+        return f"The chat is {size / 2 ** 20:.0f} MB, the limit is {self.max_bytes / 2 ** 20:.0f} MB."
+
+    # the job for an upload (bytes or a binary file, a .txt or a zip export), new or
+    # shared, or an already finished one when the chat is cached; keys are the upload's
+    # upload_keys when already known. A failed job is returned as it is so its
+    # error can be shown, and only replaced by a new one when retry is set, for a fresh
+    # upload. Raises JobRejected when the chat text is too large or the queue is full,
+    # ValueError when the upload is not a readable export
+    def submit(self, source, keys=None, retry=False):
+        keys = keys or self.upload_keys(source)
+        key, fingerprint, size = keys
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and (job.error is None or not retry):
+                return job
+
+        chat = self.chat_cache.get(key)
+        if chat is not None:
+            return Job(key, chat=chat)
+
+        if size > self.max_bytes:
+            raise JobRejected(self._too_large(size))
+        with self.lock:
+            job = self._admit(key, retry)
+        if job is not None:
+            return job
+
+        # queued jobs wait as files rather than holding their upload in memory; the chat
+        # text is copied out of a zip a chunk at a time, without holding the lock
+        spool, path = tempfile.mkstemp(prefix='chat-upload-', suffix='.txt')
+        try:
+            with os.fdopen(spool, 'wb') as f, ingest.open_export(source) as binary:
+                shutil.copyfileobj(binary, f, ingest.CHUNK_BYTES)
+        except BaseException:
+            os.remove(path)
+            raise
+
+        with self.lock:
+            # another session may have submitted the same export while this one was copied
+            try:
+                job = self._admit(key, retry)
+            except JobRejected:
+                os.remove(path)
+                raise
+            if job is not None:
+                os.remove(path)
+                return job
+            self._start()
+            job = Job(key, fingerprint, size, self._progress, path=path)
+            self.jobs[key] = job
+            future = self._pool.submit(_run, path, self.chat_cache.directory, self._progress, keys,
+                                       self.chat_cache.previous(fingerprint))
+            future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+
+    # called with the lock held: the job to share for the key, or None when a new one
+    # may start; raises JobRejected when the queue is full
+    def _admit(self, key, retry):
+        job = self.jobs.get(key)
+        if job is not None and (job.error is None or not retry):
+            return job
+        if sum(not job.finished for job in self.jobs.values()) >= self.max_jobs:
+            raise JobRejected("Too many chats are being processed right now, please try again shortly.")
+        return None
+
+    def _finish(self, job, future):
+        try:
+            chat = self.chat_cache.adopt(job.key, job.fingerprint, future.result())
+            if chat is None:
+                raise RuntimeError("The parsed chat could not be read back from the chat store.")
+            job.chat = chat
+        except Exception as error:
+            job.error = error
+            if isinstance(error, BrokenProcessPool):
+                # a worker died, most likely out of memory; start a fresh pool next time
+                self._pool = None
+            if os.path.exists(job.path):
+                os.remove(job.path)
+        with self.lock:
+            # a finished chat is served by the chat cache from now on, a failed job
+            # stays so its error can be shown and is replaced on the next upload of the file
+            if job.chat is not None and self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            self._progress.pop(job.key, None)
+
+    def active(self):
+        with self.lock:
+            return sum(not job.finished for job in self.jobs.values())
+
+job_queue = JobQueue()
@@ -0,0 +1,67 @@
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# seconds spent on each deferred import or load, in the order they happened
+load_times = {}
+
+
+# records how long a deferred load took so slow startups can be traced back
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    yield
+    load_times[name] = time.perf_counter() - start
+    logger.info("loaded %s in %.0f ms", name, load_times[name] * 1000)
+
+
+# stands in for a module and imports it on first attribute access
+class LazyModule:
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with timed(self._name):
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+
+def module(name):
+    return LazyModule(name)
+
+
+# slowest loads first
+def timings():
+    return sorted(load_times.items(), key=lambda item: item[1], reverse=True)
+
+
+if __name__ == '__main__':
+    # import the app's modules and trigger every heavy load once, printing what each cost
+    with timed('app modules'):
+        import cache
+        import helper
+        import preprocessor
+    import features
+    import sentiment
+    with timed('emoji pattern'):
+        features.emoji_pattern()
+    with timed('url extractor'):
+        features.url_extractor()
+    with timed('sentiment analyzer'):
+        sentiment.analyzer()
+    for name in ['wordcloud', 'matplotlib.pyplot', 'seaborn', 'plotly.express', 'reportlab.pdfgen.canvas']:
+        try:
+            module(name)._load()
+        except ImportError:
+            print(f"{'-':>8}     {name} (not installed)")
+    for name, seconds in timings():
+        print(f"{seconds * 1000:8.0f} ms  {name}")
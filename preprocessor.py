@@ -1,66 +1,314 @@
+import os
 import re
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+import numpy as np
 import pandas as pd
-import helper
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
-nltk.download('vader_lexicon')
+import sentiment
+import features
 
-# Initialize the VADER sentiment analyzer
-sid = SentimentIntensityAnalyzer()
+# bumped whenever the frame preprocess returns or the aggregates stored beside it
+# change, so cached parses are not reused
+PARSER_VERSION = 10
 
-def preprocess(data):
-    pattern = '\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s'
+# date and time at the start of a message, in any locale's order and separators:
+# day/month, year, separator before the time, hour, minute, seconds, AM/PM
+stamp = (r'((\d{1,2})([/.-])(\d{1,2})[/.-](\d{2,4})(,?\s)(\d{1,2}):(\d{2})(:\d{2})?'
+         r'(\s?[AaPp]\.?\s?[Mm]\.?)?)')
+# the header layout of each export dialect, the stamp is always group 1
+dialects = {
+    # "12/03/21, 14:05 - " / "3/12/21, 2:05 PM - "
+    'android': re.compile('\u200e?' + stamp + r'\s[-–]\s'),
+    # "[12/03/2021, 14:05:33] "
+    'ios': re.compile('\u200e?' r'\[' + stamp + r'\]\s'),
+}
+# sender name runs up to the first ": " after the header
+sender_pattern = re.compile(r'([\w\W]+?):\s')
+line_pattern = re.compile(r'[^\n]*\n|[^\n]+')
+meridiem_pattern = r'\s*([AaPp])\.?\s*[Mm]\.?$'
 
-    messages = re.split(pattern, data)[1:]
-    dates = re.findall(pattern, data)
+# how the timestamps of one export are written
+ChatFormat = namedtuple('ChatFormat', ['dialect', 'header', 'date_format', 'twelve_hour'])
+default_format = ChatFormat('android', dialects['android'], '%d/%m/%y, %H:%M', False)
 
-    df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-    # convert message_date type
-    df['message_date'] = pd.to_datetime(df['message_date'], format='%d/%m/%y, %H:%M - ',errors='coerce')
-    
+# lines read ahead to recognise the export format
+SAMPLE_LINES = 5000
+# exports shorter than this are parsed on one core, below it the pool costs more than it saves
+PARALLEL_MIN_CHARS = 32 * 1024 * 1024
+# worker processes for large exports
+WORKERS = int(os.environ.get('PREPROCESS_WORKERS', os.cpu_count() or 1))
+# rows are flushed from the python lists into datetime arrays in blocks of this size
+CHUNK_ROWS = 100_000
 
 
-    df.rename(columns={'message_date': 'date'}, inplace=True)
+# yield the export line by line without copying it, from a str or an open text file
+def iter_lines(data):
+    if isinstance(data, str):
+        for match in line_pattern.finditer(data):
+            yield match.group()
+    else:
+        yield from data
 
+
+# how often the dates go backwards when read in the given order
+def _order_violations(headers, day_first):
+    dates = [(int(m.group(5)), int(m.group(4)), int(m.group(2))) if day_first
+             else (int(m.group(5)), int(m.group(2)), int(m.group(4))) for m in headers]
+    return sum(later < earlier for earlier, later in zip(dates, dates[1:]))
+
+
+# picks the export dialect and date order from a sample of lines, so every
+# timestamp can then be converted with one explicit format
+def detect_format(lines):
+    counts = {name: sum(1 for line in lines if header.match(line)) for name, header in dialects.items()}
+    dialect = max(counts, key=counts.get)
+    if counts[dialect] == 0:
+        return default_format
+
+    header = dialects[dialect]
+    headers = [match for match in (header.match(line) for line in lines) if match]
+    first = headers[0]
+
+    if max(int(m.group(2)) for m in headers) > 12:
+        day_first = True
+    elif max(int(m.group(4)) for m in headers) > 12:
+        day_first = False
+    else:
+        # every day so far is <= 12: take the order that keeps the chat chronological
+        day_first = _order_violations(headers, True) <= _order_violations(headers, False)
+
+    separator = first.group(3)
+    date_part = separator.join(['%d', '%m'] if day_first else ['%m', '%d'])
+    year = '%Y' if len(first.group(5)) == 4 else '%y'
+    twelve_hour = any(m.group(10) for m in headers)
+    time_part = ('%I' if twelve_hour else '%H') + ':%M' + (':%S' if first.group(9) else '')
+    if twelve_hour:
+        time_part += ' %p'
+
+    date_format = date_part + separator + year + first.group(6) + time_part
+    return ChatFormat(dialect, header, date_format, twelve_hour)
+
+
+def _to_datetime(stamps, chat_format):
+    stamps = pd.Series(stamps, dtype=object)
+    if chat_format.twelve_hour:
+        # "2:05 pm", "2:05 p.m." and "2:05 PM" all become "2:05 PM"
+        stamps = stamps.str.replace(meridiem_pattern, r' \1M', regex=True).str.upper()
+    return pd.to_datetime(stamps, format=chat_format.date_format, errors='coerce').to_numpy()
+
+
+# single pass over the lines: header, sender and body are split as each line is
+# read and continuation lines are joined onto the message they belong to
+def parse_chat(lines, chat_format=default_format):
+    header_pattern = chat_format.header
+    date_blocks = []
+    dates = []
     users = []
     messages = []
-    for message in df['user_message']:
-        entry = re.split('([\w\W]+?):\s', message)
-        if entry[1:]:  # user name
-            users.append(entry[1])
-            messages.append(" ".join(entry[2:]))
+    names = {}
+    body = None
+
+    for line in lines:
+        header = header_pattern.match(line)
+        if header is None:
+            # continuation of a multi-line message (lines before the first header are dropped)
+            if body is not None:
+                body.append(line)
+            continue
+
+        if body is not None:
+            messages.append(''.join(body))
+        if len(dates) == CHUNK_ROWS:
+            date_blocks.append(_to_datetime(dates, chat_format))
+            dates = []
+
+        dates.append(header.group(1))
+        text = line[header.end():]
+        sender = sender_pattern.match(text)
+        if sender:
+            name = sender.group(1)
+            users.append(names.setdefault(name, name))
+            body = [text[sender.end():]]
         else:
             users.append('group_notification')
-            messages.append(entry[0])
-
-    df['user'] = users
-    df['message'] = messages
-    df.drop(columns=['user_message'], inplace=True)
-
-    df['only_date'] = df['date'].dt.date
-    df['year'] = df['date'].dt.year
-    df['month_num'] = df['date'].dt.month
-    df['month'] = df['date'].dt.month_name()
-    df['day'] = df['date'].dt.day
-    df['day_name'] = df['date'].dt.day_name()
-    df['hour'] = df['date'].dt.hour
-    df['minute'] = df['date'].dt.minute
-
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
+            body = [text]
+
+    if body is not None:
+        messages.append(''.join(body))
+    date_blocks.append(_to_datetime(dates, chat_format))
+
+    return {'date': np.concatenate(date_blocks), 'user': pd.Series(users, dtype=str),
+            'message': pd.Series(messages, dtype=str)}
+
+
+# lookup tables shared by every chat: the derived text columns are stored as
+# categoricals whose codes come straight from the datetime fields
+month_names = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+period_labels = ['00-1'] + [str(hour) + "-" + str(hour + 1) for hour in range(1, 23)] + ['23-00']
+
+
+# numeric part of the date in the smallest dtype, nullable only when some dates failed to parse
+def _compact(values, dtype):
+    if values.isna().any():
+        return values.astype(dtype.capitalize())
+    return values.astype(dtype)
+
+
+def _lookup(codes, labels):
+    codes = codes.fillna(-1).astype('int8')
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def add_date_columns(df):
+    dates = df['date'].dt
+
+    # every message of a day points at one shared date object
+    day_codes, days = pd.factorize(dates.normalize(), sort=True)
+    columns = {
+        'only_date': pd.Categorical.from_codes(day_codes, categories=days.date),
+        'year': _compact(dates.year, 'int16'),
+        'month_num': _compact(dates.month, 'int8'),
+        'month': _lookup(dates.month - 1, month_names),
+        'day': _compact(dates.day, 'int8'),
+        'day_name': _lookup(dates.dayofweek, day_names),
+        'hour': _compact(dates.hour, 'int8'),
+        'minute': _compact(dates.minute, 'int8'),
+        'period': _lookup(dates.hour, period_labels),
+    }
+    # right after the message text, ahead of the per-message features
+    position = df.columns.get_loc('message') + 1
+    for offset, (name, values) in enumerate(columns.items()):
+        df.insert(position + offset, name, values)
+    return df
+
+
+# every stage that only looks at one message at a time, so it can run on any
+# slice of the export and the slices can be concatenated afterwards
+def message_frame(lines, chat_format, workers=None, progress=None):
+    df = pd.DataFrame(parse_chat(lines, chat_format))
+    features.add_message_columns(df)
+    features.add_emoji_columns(df)
+    features.add_link_columns(df)
+    if progress:
+        progress('sentiment')
+    sentiment.add_sentiment_columns(df, workers=workers)
+    return df
+
+
+# cuts the export into about `parts` pieces, each starting on a message header
+def split_chunks(data, chat_format, parts):
+    header = chat_format.header
+    size = max(len(data) // parts, 1)
+    starts = [0]
+    position = size
+    while position < len(data):
+        newline = data.find('\n', position)
+        if newline == -1:
+            break
+        if header.match(data, newline + 1):
+            starts.append(newline + 1)
+            position = newline + 1 + size
         else:
-            period.append(str(hour) + "-" + str(hour + 1))
+            position = newline + 1
+    return [data[start:end] for start, end in zip(starts, starts[1:] + [len(data)])]
+
+
+# the same cut for a stream of lines: pieces of about `chars` characters, each ending
+# just before a message header, read one at a time
+def line_chunks(lines, chat_format, chars):
+    header = chat_format.header
+    chunk, size = [], 0
+    for line in lines:
+        if size >= chars and header.match(line):
+            yield ''.join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _chunk_frame(args):
+    text, chat_format = args
+    return message_frame(iter_lines(text), chat_format, workers=1)
+
+
+# frames of the chunks in order, with at most `ahead` chunks sent to the pool and not
+# yet collected, so a stream is never read into memory whole. Each worker parses and
+# scores its chunk, so 'sentiment' is reported once the whole export has been read and
+# only the chunks on the pool are left
+def _map_chunks(pool, chunks, chat_format, ahead, progress=None):
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(_chunk_frame, (chunk, chat_format)))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    if progress:
+        progress('sentiment')
+    while pending:
+        yield pending.popleft().result()
+
+
+# data is the export as a str or as lines; size, the byte size of a stream of lines
+# when known, lets a large stream be parsed on the pool like a large str. progress,
+# when given, is called with the name of each stage as it starts
+def preprocess(data, workers=None, progress=None, size=None):
+    workers = workers or WORKERS
+    if progress:
+        progress('parse')
+    lines = iter_lines(data)
+    sample = list(islice(lines, SAMPLE_LINES))
+    chat_format = detect_format(sample)
+
+    size = len(data) if isinstance(data, str) else size or 0
+    if workers > 1 and size >= PARALLEL_MIN_CHARS:
+        if isinstance(data, str):
+            chunks = split_chunks(data, chat_format, workers * 4)
+        else:
+            chunks = line_chunks(chain(sample, lines), chat_format, size // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frames = list(_map_chunks(pool, chunks, chat_format, workers * 2, progress))
+        df = pd.concat(frames, ignore_index=True)
+        df.attrs['sentiment_stats'] = sentiment.merge_stats([frame.attrs['sentiment_stats'] for frame in frames])
+    else:
+        df = message_frame(chain(sample, lines), chat_format, workers=workers, progress=progress)
+
+    add_date_columns(df)
+    df.attrs['chat_format'] = {'dialect': chat_format.dialect, 'date_format': chat_format.date_format,
+                               'twelve_hour': chat_format.twelve_hour}
+
+    return df
+
+
+# the messages in `tail` (a str or lines) parsed with the chat's own format and appended
+# to an already parsed chat: (combined frame, frame of just the new messages), or None
+# when the tail does not start on a message
+def append_messages(df, tail, workers=None, progress=None):
+    stored = df.attrs.get('chat_format')
+    if stored is None:
+        return None
+    chat_format = ChatFormat(stored['dialect'], dialects[stored['dialect']], stored['date_format'],
+                             stored['twelve_hour'])
+    lines = iter_lines(tail)
+    first = next(lines, '')
+    if not chat_format.header.match(first):
+        return None
 
-    df['period'] = period
+    if progress:
+        progress('parse')
+    tail_df = message_frame(chain([first], lines), chat_format, workers=workers, progress=progress)
+    add_date_columns(tail_df)
 
-    df['sentiment'] = df['message'].apply(lambda x: sid.polarity_scores(x)['compound'])
-    df['sentiment_category'] = df['sentiment'].apply(
-        lambda x: 'Positive' if x > 0.05 else 'Negative' if x < -0.05 else 'Neutral')
-    
+    # both parts point into one sorted table of days, as a full parse would build
+    days = df['only_date'].cat.categories.union(tail_df['only_date'].cat.categories)
+    head = df.assign(only_date=df['only_date'].cat.set_categories(days))
+    tail_df['only_date'] = tail_df['only_date'].cat.set_categories(days)
 
-    return df
\ No newline at end of file
+    combined = pd.concat([head, tail_df], ignore_index=True)
+    combined.attrs = dict(df.attrs)
+    combined.attrs['sentiment_stats'] = sentiment.merge_stats([df.attrs['sentiment_stats'],
+                                                               tail_df.attrs['sentiment_stats']])
+    return combined, tail_df
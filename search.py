@@ -0,0 +1,142 @@
+import re
+import string
+import numpy as np
+import pandas as pd
+import tokenizer
+
+# stripped from both ends of every token, so "hello," and "hello" are the same word
+PUNCTUATION = string.punctuation + '“”‘’…'
+PAGE_SIZE = 20
+
+
+# lowercased whitespace tokens without surrounding punctuation, indexed by message row
+def words(messages):
+    tokens = tokenizer.tokens(messages, stop_words=()).str.strip(PUNCTUATION)
+    return tokens[tokens != '']
+
+
+# a query is OR-separated groups of terms and "quoted phrases" that must all match
+def parse_query(query):
+    groups = [[]]
+    for phrase, term in re.findall(r'"([^"]*)"|(\S+)', query):
+        if term == 'OR':
+            groups.append([])
+            continue
+        normalized = words(pd.Series([phrase or term], dtype=str)).tolist()
+        if normalized:
+            groups[-1].append(normalized)
+    return [group for group in groups if group]
+
+
+# regex matching the phrase's words as consecutive tokens of a lowercased message,
+# allowing the punctuation words() strips around and between them
+def phrase_pattern(terms):
+    punctuation = '[' + re.escape(PUNCTUATION) + ']*'
+    separator = punctuation + r'(?:\s+' + punctuation + ')+'
+    return (r'(?:^|\s)' + punctuation + separator.join(re.escape(term) for term in terms)
+            + punctuation + r'(?:\s|$)')
+
+
+# the entries of sorted array a that also occur in sorted array b
+def intersect(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return a
+    positions = np.searchsorted(b, a)
+    found = b[np.minimum(positions, len(b) - 1)] == a
+    return a[found]
+
+
+# token -> sorted row ids of the messages containing it, kept as one sorted vocabulary,
+# an offsets array and a single uint32 array of row ids
+class SearchIndex:
+
+    def __init__(self, df=None, chunk_rows=100_000, vocabulary=None, offsets=None, postings=None):
+        if vocabulary is None:
+            vocabulary, offsets, postings = self._build(df, chunk_rows)
+        self.vocabulary = pd.Index(vocabulary)
+        self.offsets = offsets
+        self.postings = postings
+
+    @staticmethod
+    def _build(df, chunk_rows):
+        rows = np.flatnonzero(~(df['is_system'] | df['is_media'] | df['is_deleted']).to_numpy())
+        word_parts, row_parts = [], []
+        for start in range(0, len(rows), chunk_rows):
+            ids = rows[start:start + chunk_rows]
+            chunk = words(df['message'].take(ids).reset_index(drop=True))
+            pairs = pd.DataFrame({'word': chunk.to_numpy(),
+                                  'row': ids[chunk.index.to_numpy(dtype='int64')]}).drop_duplicates()
+            word_parts.append(pairs['word'])
+            row_parts.append(pairs['row'].to_numpy(dtype=np.uint32))
+
+        if not word_parts:
+            return [], np.zeros(1, dtype=np.int64), np.array([], dtype=np.uint32)
+        codes, vocabulary = pd.factorize(pd.concat(word_parts, ignore_index=True), sort=True)
+        row_ids = np.concatenate(row_parts)
+        order = np.lexsort((row_ids, codes))
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(vocabulary)), out=offsets[1:])
+        return vocabulary, offsets, row_ids[order]
+
+    @property
+    def nbytes(self):
+        return int(self.vocabulary.memory_usage(deep=True)) + self.offsets.nbytes + self.postings.nbytes
+
+    def rows(self, word):
+        position = self.vocabulary.get_indexer([word])[0]
+        if position == -1:
+            return self.postings[:0]
+        return self.postings[self.offsets[position]:self.offsets[position + 1]]
+
+    # rows containing every word, intersected starting from the rarest
+    def rows_all(self, terms):
+        postings = sorted((self.rows(word) for word in terms), key=len)
+        result = postings[0]
+        for other in postings[1:]:
+            result = intersect(result, other)
+        return result
+
+
+# row ids of the messages matching the query, optionally only the selected user's and
+# only those sent between start and end (dates, inclusive)
+def search(chat, query, selected_user='Overall', start=None, end=None):
+    index = chat.search_index
+    matches = []
+    for group in parse_query(query):
+        hits = index.rows_all([word for terms in group for word in terms])
+        phrases = [terms for terms in group if len(terms) > 1]
+        if phrases and len(hits):
+            # the words of a phrase are all in these messages, check that they are adjacent
+            text = chat.frame(['message'])['message'].take(hits).str.lower()
+            found = np.ones(len(hits), dtype=bool)
+            for phrase in phrases:
+                found &= text.str.contains(phrase_pattern(phrase)).to_numpy(dtype=bool)
+            hits = hits[found]
+        matches.append(hits)
+    if not matches:
+        return np.array([], dtype=np.uint32)
+    hits = matches[0] if len(matches) == 1 else np.unique(np.concatenate(matches))
+
+    if selected_user != 'Overall':
+        hits = intersect(hits, chat.rows.get(selected_user, np.array([], dtype=np.intp)).astype(np.uint32))
+    if start is not None or end is not None:
+        dates = chat.frame(['date'])['date'].to_numpy()[hits]
+        keep = np.ones(len(hits), dtype=bool)
+        if start is not None:
+            keep &= dates >= np.datetime64(pd.Timestamp(start))
+        if end is not None:
+            keep &= dates < np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1))
+        hits = hits[keep]
+    return hits
+
+
+def page_count(hits, page_size=PAGE_SIZE):
+    return max(1, -(-len(hits) // page_size))
+
+
+# date, user and message of one page of hits, pages numbered from 1
+def results_page(chat, hits, page, page_size=PAGE_SIZE):
+    rows = hits[(page - 1) * page_size:page * page_size]
+    return chat.frame(['date', 'user', 'message']).take(rows).reset_index(drop=True)
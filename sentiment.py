@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import lazy
+
+vader_sentiment = lazy.module('vaderSentiment.vaderSentiment')
+
+# most recent message texts kept with their compound score
+CACHE_SIZE = 100_000
+# below this many distinct texts starting a process pool costs more than it saves
+PARALLEL_THRESHOLD = 50_000
+
+categories = ['Positive', 'Neutral', 'Negative']
+
+_analyzer = None
+
+
+# the VADER analyzer, built on first use from the lexicon vaderSentiment bundles, so
+# every server scores the same text the same way and nothing is ever downloaded
+def analyzer():
+    global _analyzer
+    if _analyzer is None:
+        with lazy.timed('vader lexicon'):
+            _analyzer = vader_sentiment.SentimentIntensityAnalyzer()
+    return _analyzer
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def polarity(text):
+    return analyzer().polarity_scores(text)['compound']
+
+
+# scores one batch of texts, also returning how many came from the cache
+def _score_batch(texts):
+    hits = polarity.cache_info().hits
+    scores = [polarity(text) for text in texts]
+    return scores, polarity.cache_info().hits - hits
+
+
+def categorize(scores):
+    codes = np.select([scores > 0.05, scores < -0.05], [0, 2], 1)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+# compound score for every message; identical texts are scored once and rows
+# flagged in skip (system notices, media placeholders) are left neutral
+def score_messages(messages, skip=None, workers=None):
+    codes, uniques = pd.factorize(messages)
+    if skip is None:
+        skip = np.zeros(len(codes), dtype=bool)
+    else:
+        skip = np.asarray(skip, dtype=bool)
+
+    needed = np.zeros(len(uniques), dtype=bool)
+    needed[codes[~skip]] = True
+    texts = np.asarray(uniques, dtype=object)[needed]
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(texts) >= PARALLEL_THRESHOLD:
+        batches = np.array_split(texts, workers * 4)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_score_batch, batches))
+    else:
+        results = [_score_batch(texts)]
+
+    unique_scores = np.zeros(len(uniques))
+    unique_scores[needed] = [score for batch, _ in results for score in batch]
+    scores = unique_scores[codes]
+    scores[skip] = 0.0
+
+    cache_hits = sum(hits for _, hits in results)
+    stats = {
+        'messages': len(codes),
+        'skipped': int(skip.sum()),
+        'unique': len(texts),
+        'scored': len(texts) - cache_hits,
+        'cache_hits': cache_hits,
+        'cache_hit_rate': cache_hits / len(texts) if len(texts) else 0.0,
+    }
+    return scores, stats
+
+
+# 'sentiment' and 'sentiment_category' columns for a frame with the message flags;
+# system notices and media or deleted-message placeholders carry no sentiment
+def add_sentiment_columns(df, workers=None):
+    skip = df['is_system'] | df['is_media'] | df['is_deleted']
+    scores, stats = score_messages(df['message'], skip=skip, workers=workers)
+    df['sentiment'] = scores
+    df['sentiment_category'] = categorize(scores)
+    df.attrs['sentiment_stats'] = stats
+    return df
+
+
+# stats of a chat scored in several parts
+def merge_stats(parts):
+    stats = {key: sum(part[key] for part in parts)
+             for key in ['messages', 'skipped', 'unique', 'scored', 'cache_hits']}
+    stats['cache_hit_rate'] = stats['cache_hits'] / stats['unique'] if stats['unique'] else 0.0
+    return stats
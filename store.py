@@ -0,0 +1,88 @@
+import json
+import os
+from aggregates import Aggregates
+from chat import Chat
+from search import SearchIndex
+from tokenizer import TokenIndex
+import lazy
+
+pa = lazy.module('pyarrow')
+pc = lazy.module('pyarrow.compute')
+
+# text columns with few distinct values, stored once per value in the file
+dictionary_columns = ['user', 'month', 'day_name', 'period', 'sentiment_category']
+
+
+def _write_table(table, path):
+    # written uncompressed so the file can be memory-mapped and read without copying
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _read_table(path):
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def paths(prefix):
+    return {
+        'messages': prefix + '.arrow',
+        'aggregates': prefix + '.aggregates.arrow',
+        'tokens': prefix + '.tokens.arrow',
+    }
+
+
+# the parsed frame as an Arrow IPC file plus sidecars with the chat's aggregates and
+# word counts, so a stored chat opens without recomputing either
+def write_chat(prefix, chat):
+    files = paths(prefix)
+
+    table = pa.Table.from_pandas(chat.df, preserve_index=False)
+    for name in dictionary_columns:
+        position = table.schema.get_field_index(name)
+        if position != -1 and not pa.types.is_dictionary(table.schema.field(name).type):
+            table = table.set_column(position, name, pc.dictionary_encode(table[name]))
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'chat_attrs'] = json.dumps(chat.df.attrs).encode()
+    _write_table(table.replace_schema_metadata(metadata), files['messages'])
+
+    _write_table(pa.Table.from_pandas(chat.aggregates.base, preserve_index=False), files['aggregates'])
+    counts = chat.token_index.counts.rename('count').reset_index()
+    _write_table(pa.Table.from_pandas(counts, preserve_index=False), files['tokens'])
+
+
+# the search index is built on the first search, so it is stored on its own
+def search_path(prefix):
+    return prefix + '.search.arrow'
+
+
+# one row per word with the sorted row ids of the messages holding it as a list
+def write_search_index(prefix, index):
+    rows = pa.LargeListArray.from_arrays(pa.array(index.offsets, pa.int64()), pa.array(index.postings, pa.uint32()))
+    _write_table(pa.table({'word': pa.array(index.vocabulary, pa.string()), 'rows': rows}), search_path(prefix))
+
+
+def open_search_index(prefix):
+    table = _read_table(search_path(prefix))
+    rows = table['rows'].combine_chunks()
+    return SearchIndex(vocabulary=table['word'].to_pandas(), offsets=rows.offsets.to_numpy(),
+                       postings=rows.values.to_numpy())
+
+
+def exists(prefix):
+    return all(os.path.exists(path) for path in paths(prefix).values())
+
+
+# memory-maps a stored chat; message columns are only converted when a panel asks for them
+def open_chat(prefix):
+    files = paths(prefix)
+    table = _read_table(files['messages'])
+    attrs = json.loads(table.schema.metadata.get(b'chat_attrs', b'{}'))
+
+    chat = Chat(table=table, attrs=attrs)
+    chat._aggregates = Aggregates(base=_read_table(files['aggregates']).to_pandas())
+    counts = _read_table(files['tokens']).to_pandas().set_index(['user', 'word'])['count']
+    chat._token_index = TokenIndex(counts=counts)
+    return chat
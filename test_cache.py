@@ -0,0 +1,57 @@
+import pandas as pd
+import cache
+import helper
+import preprocessor
+from chat import Chat
+
+
+def _chat_text(messages=600):
+    return ''.join(f"{1 + number // 100:02d}/01/21, 10:{number % 60:02d} - "
+                   f"{['Alice', 'Bob'][number % 2]}: message number {number}\n" for number in range(messages)).encode()
+
+
+# a chat opened from the store starts small and is charged for what it converts and builds
+def test_stored_chat_is_measured_again_on_every_hit(tmp_path):
+    key, _ = cache.ChatCache(directory=str(tmp_path)).load(_chat_text(), workers=1)
+    chat_cache = cache.ChatCache(directory=str(tmp_path))
+    chat = chat_cache.get(key)
+    opened = chat_cache.size
+
+    helper.fetch_stats('Alice', chat)
+    chat.interactions
+    chat.search_index
+    assert chat_cache.get(key) is chat
+    assert chat_cache.size == chat.nbytes > opened
+
+    chat.df
+    chat_cache.get(key)
+    assert chat_cache.size == chat.nbytes
+
+
+def test_chat_grown_past_the_limit_is_evicted(tmp_path):
+    key, _ = cache.ChatCache(directory=str(tmp_path)).load(_chat_text(), workers=1)
+    chat_cache = cache.ChatCache(directory=str(tmp_path))
+    chat = chat_cache.get(key)
+    chat_cache.max_bytes = chat.nbytes
+    chat.df
+    chat_cache.get(key)
+    assert chat_cache.size == 0 and not chat_cache.chats
+
+
+def test_extended_chat_matches_full_parse(monkeypatch):
+    data = _chat_text()
+    full = Chat(preprocessor.preprocess(data.decode(), workers=1))
+    chat_cache = cache.ChatCache(directory=None)
+    chat_cache.load(data[:data.index(b"04/01/21")], workers=1)
+
+    def full_parse(*args, **kwargs):
+        raise AssertionError("the longer export was parsed in full")
+
+    monkeypatch.setattr(preprocessor, 'preprocess', full_parse)
+    _, extended = chat_cache.load(data, workers=1)
+    pd.testing.assert_frame_equal(extended.df, full.df)
+    for user in ['Overall', 'Alice']:
+        pd.testing.assert_frame_equal(extended.aggregates.daily_timeline(user),
+                                      full.aggregates.daily_timeline(user))
+        pd.testing.assert_frame_equal(extended.aggregates.monthly_timeline(user),
+                                      full.aggregates.monthly_timeline(user))
@@ -0,0 +1,22 @@
+import io
+import zipfile
+import pandas as pd
+import cache
+import ingest
+import preprocessor
+
+
+# a BOM, mixed line endings and a bad byte read the same from bytes or from a zip export
+def test_streamed_upload_matches_text():
+    text = "\ufeff12/03/21, 14:05 - Alice: hi\r\n12/03/21, 14:06 - Bob: caf\xe9\n"
+    data = text.encode() + b"12/03/21, 14:07 - Bob: \xff\n"
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as export:
+        export.writestr('WhatsApp Chat with Bob.txt', data)
+        export.writestr('IMG-0001.jpg', b'\xff\xd8')
+    expected = preprocessor.preprocess(data.decode('utf-8-sig', errors='replace'), workers=1)
+    for source in [data, archive]:
+        with ingest.open_export(source) as binary:
+            pd.testing.assert_frame_equal(preprocessor.preprocess(ingest.chat_lines(binary), workers=1), expected)
+    assert cache.source_keys(data) == cache.source_keys(archive)
+    assert ingest.text_size(archive) == len(data)
@@ -0,0 +1,62 @@
+import pandas as pd
+from interactions import Interactions
+
+# sessions split after an hour of silence (the default gap); answers worked out by hand
+MESSAGES = [
+    ('2021-03-01 10:00', 'Alice'),
+    ('2021-03-01 10:02', 'Bob'),      # Bob replies to Alice after 120 s
+    ('2021-03-01 10:03', 'Bob'),      # same sender, not a reply
+    ('2021-03-01 10:10', 'Alice'),    # Alice replies to Bob after 420 s
+    ('2021-03-01 10:11', 'group_notification'),
+    (None, 'Alice'),                  # unparseable date, left out
+    ('2021-03-01 12:00', 'Carol'),    # 110 minutes later: a new session
+    ('2021-03-01 12:30', 'Alice'),    # Alice replies to Carol after 1800 s
+    ('2021-03-01 12:31', 'Alice'),
+]
+
+
+def _interactions():
+    df = pd.DataFrame({
+        'date': pd.to_datetime([date for date, _ in MESSAGES]),
+        'user': [user for _, user in MESSAGES],
+    })
+    df['is_system'] = df['user'] == 'group_notification'
+    return Interactions(df)
+
+
+def test_reply_times():
+    interactions = _interactions()
+    overall = interactions.reply_times('Overall').set_index('user')
+    assert overall.index.tolist() == ['Alice', 'Bob']
+    assert overall.loc['Alice'].tolist() == [2, 1110.0, 420 + 0.9 * 1380]
+    assert overall.loc['Bob'].tolist() == [1, 120.0, 120.0]
+
+    alice = interactions.reply_times('Alice').set_index('user')['median_seconds']
+    assert alice.to_dict() == {'Bob': 420.0, 'Carol': 1800.0}
+    assert interactions.reply_times('Carol').empty
+
+    matrix = interactions.reply_matrix()
+    assert matrix.loc['Alice', 'Carol'] == 1800.0
+    assert matrix.loc['Bob', 'Alice'] == 120.0
+
+
+def test_sessions():
+    interactions = _interactions()
+    sessions = interactions.sessions
+    assert sessions['messages'].tolist() == [4, 3]
+    assert sessions['participants'].tolist() == [2, 2]
+    assert sessions['minutes'].tolist() == [10.0, 31.0]
+    assert sessions['starter'].tolist() == ['Alice', 'Carol']
+    assert sessions['ender'].tolist() == ['Alice', 'Alice']
+
+    assert interactions.session_summary('Overall') == {'sessions': 2, 'median_minutes': 20.5,
+                                                        'mean_messages': 3.5}
+    assert interactions.session_summary('Bob') == {'sessions': 1, 'median_minutes': 10.0,
+                                                    'mean_messages': 4.0, 'started': 0, 'ended': 0}
+
+
+def test_starters():
+    starters = _interactions().starters().set_index('user')
+    assert starters.loc['Alice'].tolist() == [1, 2]
+    assert starters.loc['Carol'].tolist() == [1, 0]
+    assert starters.loc['Bob'].tolist() == [0, 0]
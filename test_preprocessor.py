@@ -0,0 +1,127 @@
+import pandas as pd
+import pytest
+import ingest
+import preprocessor
+
+
+def _parse(text):
+    return preprocessor.preprocess(text, workers=1)
+
+
+# one small export per dialect: text, expected dates, users and messages
+DIALECTS = {
+    'android_24h': (
+        "12/03/21, 14:05 - Alice: hi there\n"
+        "12/03/21, 14:07 - Bob: hello\n"
+        "second line\n"
+        "13/03/21, 09:00 - Bob joined using this group's invite link\n",
+        ['2021-03-12 14:05', '2021-03-12 14:07', '2021-03-13 09:00'],
+        ['Alice', 'Bob', 'group_notification'],
+        ["hi there\n", "hello\nsecond line\n", "Bob joined using this group's invite link\n"],
+    ),
+    'us_12h': (
+        "3/12/21, 2:05 PM - Alice: afternoon\n"
+        "3/12/21, 11:59 pm - Bob: late\n"
+        # newer exports put a narrow no-break space before AM/PM
+        "3/13/21, 12:01\u202fAM - Alice: early\n",
+        ['2021-03-12 14:05', '2021-03-12 23:59', '2021-03-13 00:01'],
+        ['Alice', 'Bob', 'Alice'],
+        ["afternoon\n", "late\n", "early\n"],
+    ),
+    'ios': (
+        "\u200e[12/03/2021, 14:05:33] Alice: hi\n"
+        "[12/03/2021, 14:06:01] Bob: yo\n",
+        ['2021-03-12 14:05:33', '2021-03-12 14:06:01'],
+        ['Alice', 'Bob'],
+        ["hi\n", "yo\n"],
+    ),
+    'german': (
+        "12.03.21, 14:05 - Alice: Hallo\n"
+        "14.03.21, 08:30 - Bob: Moin\n",
+        ['2021-03-12 14:05', '2021-03-14 08:30'],
+        ['Alice', 'Bob'],
+        ["Hallo\n", "Moin\n"],
+    ),
+    # every day is <= 12, read month-first because that keeps the chat in order
+    'ambiguous': (
+        "01/12/21, 10:00 - Alice: a\n"
+        "1/2/21, 10:00 - Bob: b\n"
+        "1/3/21, 10:00 - Alice: c\n"
+        "2/1/21, 10:00 - Bob: d\n",
+        ['2021-01-12 10:00', '2021-01-02 10:00', '2021-01-03 10:00', '2021-02-01 10:00'],
+        ['Alice', 'Bob', 'Alice', 'Bob'],
+        ["a\n", "b\n", "c\n", "d\n"],
+    ),
+}
+
+
+@pytest.mark.parametrize('dialect', DIALECTS)
+def test_dialects(dialect):
+    text, dates, users, messages = DIALECTS[dialect]
+    df = _parse(text)
+    assert df['date'].tolist() == [pd.Timestamp(date) for date in dates]
+    assert df['user'].tolist() == users
+    assert df['message'].tolist() == messages
+
+
+def test_ambiguous_dates_read_day_first_when_in_order():
+    text = ("01/02/21, 10:00 - Alice: a\n"
+            "03/02/21, 10:00 - Bob: b\n"
+            "05/02/21, 10:00 - Alice: c\n"
+            "01/03/21, 10:00 - Bob: d\n")
+    chat_format = preprocessor.detect_format(text.splitlines(True))
+    assert chat_format.date_format.startswith('%d/%m')
+    assert _parse(text)['date'].is_monotonic_increasing
+
+
+def test_unparseable_dates_are_kept_as_missing():
+    df = _parse("01/02/21, 14:05 - Alice: hi\n"
+                "31/02/21, 14:05 - Bob: no such day\n")
+    assert df['date'].isna().tolist() == [False, True]
+    assert df['hour'].isna().tolist() == [False, True]
+    assert df['user'].tolist() == ['Alice', 'Bob']
+
+
+def _long_chat(messages=3000):
+    lines = []
+    for number in range(messages):
+        day, minute = 1 + number // 1440, number % 1440
+        lines.append(f"{day:02d}/01/21, {minute // 60:02d}:{minute % 60:02d} - "
+                     f"{['Alice', 'Bob', 'Carol'][number % 3]}: message {number} :)\n")
+        if number % 7 == 0:
+            lines.append(f"continued {number}\n")
+    return ''.join(lines)
+
+
+def test_parallel_parse_equals_serial(monkeypatch):
+    text = _long_chat()
+    serial = _parse(text)
+    monkeypatch.setattr(preprocessor, 'PARALLEL_MIN_CHARS', 1000)
+    pd.testing.assert_frame_equal(preprocessor.preprocess(text, workers=2), serial)
+    data = text.encode()
+    with ingest.open_export(data) as binary:
+        streamed = preprocessor.preprocess(ingest.chat_lines(binary), workers=2, size=len(data))
+    pd.testing.assert_frame_equal(streamed, serial)
+
+
+def test_line_chunks_start_on_headers():
+    text = _long_chat()
+    chat_format = preprocessor.detect_format(text.splitlines(True))
+    chunks = list(preprocessor.line_chunks(preprocessor.iter_lines(text), chat_format, 10_000))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == text
+    assert all(chat_format.header.match(chunk) for chunk in chunks)
+
+
+def test_append_equals_full_parse():
+    text = _long_chat()
+    split = text.index("03/01/21, 00:00")
+    combined, tail_df = preprocessor.append_messages(_parse(text[:split]), text[split:])
+    full = _parse(text)
+    pd.testing.assert_frame_equal(combined, full)
+    assert len(tail_df) == len(full) - len(_parse(text[:split]))
+
+
+def test_append_rejects_tail_off_a_message():
+    df = _parse("01/02/21, 14:05 - Alice: hi\n")
+    assert preprocessor.append_messages(df, "not a header\n") is None
@@ -0,0 +1,83 @@
+import datetime
+import numpy as np
+import preprocessor
+import search
+import store
+from chat import Chat
+
+# row: date, sender, text
+MESSAGES = [
+    ("01/03/21, 09:00", "Alice", "Good morning, everyone!"),
+    ("01/03/21, 09:05", "Bob", "morning... good to see you"),
+    ("02/03/21, 18:30", "Alice", "The pizza place was GOOD."),
+    ("03/03/21, 20:00", "Carol", "Good, morning people"),
+    ("03/03/21, 20:01", "Bob", "<Media omitted>"),
+    ("04/03/21, 07:15", "Carol", "pizza or pasta tonight?"),
+    ("04/03/21, 23:59", "Bob", "good-morning is one word here"),
+]
+
+
+def _chat():
+    text = ''.join(f"{date} - {user}: {message}\n" for date, user, message in MESSAGES)
+    return Chat(preprocessor.preprocess(text, workers=1))
+
+
+def _rows(chat, query, **filters):
+    return search.search(chat, query, **filters).tolist()
+
+
+def test_terms_must_all_match():
+    chat = _chat()
+    assert _rows(chat, "good") == [0, 1, 2, 3]
+    assert _rows(chat, "GOOD pizza") == [2]
+    assert _rows(chat, "omitted") == []
+
+
+def test_or_groups_are_merged_in_row_order():
+    chat = _chat()
+    assert _rows(chat, "pasta OR everyone") == [0, 5]
+    assert _rows(chat, "pizza place OR people") == [2, 3]
+    assert _rows(chat, "OR") == []
+
+
+# adjacent words match across punctuation, the same words apart or reordered do not
+def test_phrases_need_adjacent_words():
+    chat = _chat()
+    assert _rows(chat, '"good morning"') == [0, 3]
+    assert _rows(chat, '"morning good"') == [1]
+    assert _rows(chat, '"pizza place" OR "good morning"') == [0, 2, 3]
+    assert _rows(chat, '"good morning" people') == [3]
+
+
+def test_user_and_inclusive_dates():
+    chat = _chat()
+    assert _rows(chat, "good", selected_user='Bob') == [1]
+    assert _rows(chat, "good", selected_user='Dave') == []
+    assert _rows(chat, "good", start=datetime.date(2021, 3, 2), end=datetime.date(2021, 3, 3)) == [2, 3]
+    # the end day includes its last minute
+    assert _rows(chat, "word", end=datetime.date(2021, 3, 4)) == [6]
+    assert _rows(chat, "word", start=datetime.date(2021, 3, 5)) == []
+
+
+def test_results_page():
+    chat = _chat()
+    hits = search.search(chat, "good")
+    assert search.page_count(hits, page_size=3) == 2
+    page = search.results_page(chat, hits, 2, page_size=3)
+    assert page['user'].tolist() == ['Carol']
+    assert page.columns.tolist() == ['date', 'user', 'message']
+
+
+def test_stored_index_answers_the_same(tmp_path):
+    chat = _chat()
+    prefix = str(tmp_path / 'chat')
+    store.write_search_index(prefix, chat.search_index)
+    stored = store.open_search_index(prefix)
+    assert stored.vocabulary.equals(chat.search_index.vocabulary)
+    for word in ['good', 'pizza', 'missing']:
+        assert np.array_equal(stored.rows(word), chat.search_index.rows(word))
+
+    reopened = _chat()
+    reopened._search_index = stored
+    for query in ['good', '"good morning" OR pasta']:
+        assert _rows(reopened, query) == _rows(chat, query)
@@ -0,0 +1,26 @@
+import pandas as pd
+import tokenizer
+
+
+# a stop word is only ever a whole token: "hai" and "a" must not eat into longer words
+def test_stop_words_only_remove_whole_words():
+    stop_words = tokenizer.load_stop_words()
+    assert {'hai', 'a'} <= stop_words
+    messages = pd.Series(["Hai a chair\n", "banana haircut hai\n"], dtype=str)
+    words = tokenizer.tokens(messages)
+    assert words.tolist() == ['chair', 'banana', 'haircut']
+    assert words.index.tolist() == [0, 1, 1]
+
+
+def test_token_index_counts_words_per_user():
+    df = pd.DataFrame({
+        'user': ['Alice', 'Bob', 'Alice', 'group_notification'],
+        'message': ["chair hai\n", "chair banana\n", "<Media omitted>\n", "chair added\n"],
+        'is_system': [False, False, False, True],
+        'is_media': [False, False, True, False],
+        'is_deleted': [False, False, False, False],
+    })
+    index = tokenizer.TokenIndex(df, chunk_rows=1)
+    assert index.frequencies('Overall').to_dict() == {'chair': 2, 'banana': 1}
+    assert index.frequencies('Alice').to_dict() == {'chair': 1}
+    assert index.frequencies('Carol').empty
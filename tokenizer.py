@@ -0,0 +1,86 @@
+import os
+from functools import lru_cache
+import pandas as pd
+
+STOP_WORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stop_hinglish.txt')
+
+
+# one stop word per line, read once per file into a hashed set
+@lru_cache(maxsize=None)
+def load_stop_words(path=STOP_WORDS_FILE):
+    with open(path, 'r', encoding='utf-8') as f:
+        return frozenset(f.read().split())
+
+
+# the bundled Hinglish list by default, another file by path, or any collection of words
+def stop_word_set(stop_words=None):
+    if stop_words is None:
+        return load_stop_words()
+    if isinstance(stop_words, str):
+        return load_stop_words(stop_words)
+    return frozenset(word.lower() for word in stop_words)
+
+
+# lowercased whitespace tokens of the messages without stop words, one per row,
+# indexed by the row of the message they came from
+def tokens(messages, stop_words=None):
+    words = messages.str.lower().str.split().explode().dropna()
+    return words[~words.isin(stop_word_set(stop_words))]
+
+
+# messages that carry words: no system notices and no media or deleted-message placeholders
+def text_messages(df):
+    return df[~(df['is_system'] | df['is_media'] | df['is_deleted'])]
+
+
+# word counts per user, built once per chat in chunks of messages so memory
+# follows the vocabulary rather than the size of the corpus
+class TokenIndex:
+
+    def __init__(self, df=None, stop_words=None, chunk_rows=100_000, counts=None):
+        if counts is None:
+            counts = self._count(df, stop_words, chunk_rows)
+        self.stop_words = stop_words
+        self.counts = counts.sort_index()
+        self.overall = counts.groupby(level='word').sum()
+
+    # each chunk is taken from the few columns needed and filtered on its own, so no
+    # copy of the whole frame is ever made
+    @staticmethod
+    def _count(df, stop_words, chunk_rows):
+        columns = ['user', 'message', 'is_system', 'is_media', 'is_deleted']
+        counts = pd.Series([], dtype='int64', index=pd.MultiIndex.from_arrays([[], []], names=['user', 'word']))
+
+        for start in range(0, len(df), chunk_rows):
+            chunk = text_messages(df.iloc[start:start + chunk_rows][columns]).reset_index(drop=True)
+            words = tokens(chunk['message'], stop_words)
+            pairs = pd.DataFrame({'user': chunk['user'].to_numpy()[words.index.to_numpy(dtype='int64')],
+                                  'word': words.to_numpy()})
+            counts = pd.concat([counts, pairs.groupby(['user', 'word']).size()]).groupby(level=['user', 'word']).sum()
+        return counts
+
+    @property
+    def nbytes(self):
+        return int(self.counts.memory_usage(deep=True) + self.overall.memory_usage(deep=True))
+
+    # index after appending new messages, counting only the new ones
+    def extend(self, tail_df):
+        tail = TokenIndex(tail_df, self.stop_words)
+        counts = self.counts.add(tail.counts, fill_value=0).astype('int64')
+        return TokenIndex(stop_words=self.stop_words, counts=counts)
+
+    # word -> count for one user or the whole chat, most frequent first
+    def frequencies(self, selected_user):
+        if selected_user == 'Overall':
+            counts = self.overall
+        else:
+            try:
+                counts = self.counts.loc[selected_user]
+            except KeyError:
+                counts = self.overall.iloc[:0]
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def most_common(self, selected_user, n=20):
+        most_common_df = self.frequencies(selected_user).head(n).reset_index()
+        most_common_df.columns = [0, 1]
+        return most_common_df